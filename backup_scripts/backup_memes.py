@@ -1,74 +1,258 @@
-from pydrive.drive import GoogleDrive
-from pydrive.auth import GoogleAuth
+import dotenv
 
+import hashlib
+import json
 import os
-import dotenv
+import random
+import shutil
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Callable, Dict, Optional, TypeVar
+
+# Make the bot's packages importable when this is run straight from crontab
+sys.path.append(str(Path(__file__).resolve().parents[1]))
 
+from commands import STATE_PATH
+from commands.persistence import save_json
 
-# Backs up all of the images (memes) to google drive once a day
+
+# Backs up all of the images (memes) to google drive once a day. A manifest of every meme we have backed up, with its
+# size, modification time, hash and Drive file id, is kept between runs so that only new or changed memes are sent
 
 # Initialize and load the memes and credentials environment variables
 dotenv.load_dotenv()
 MEMES_PATH = os.getenv('MEMES_FOLDER')
 CREDENTIALS = os.getenv('CREDENTIALS')
+MANIFEST = Path(STATE_PATH, 'meme-backup-manifest.json')
+
+ROOT_FOLDER = 'Bruh Bot Database'  # The Google Drive folder the memes are backed up into
+UPLOAD_WORKERS = 4                 # How many memes are uploaded at the same time
+UPLOAD_ATTEMPTS = 5                # How many times an upload is tried before we give up on it until the next run
 
-# Create a new authentication system and attempt to load credentials from file
-AUTH = GoogleAuth()
-AUTH.LoadCredentialsFile(CREDENTIALS)
+T = TypeVar('T')
 
-# If the credentials failed to load from file authenticate with teh web server
-if AUTH.credentials is None:
-    AUTH.LocalWebserverAuth()
 
-# If the token was just expired then refresh it and continue
-elif AUTH.access_token_expired:
-    AUTH.Refresh()
+class PyDriveClient:
+    """The few Google Drive operations the backup needs, done through PyDrive"""
 
-# Otherwise just authorize like normal
-else:
-    AUTH.Authorize()
+    def __init__(self, drive) -> None:
+        self.drive = drive
 
-# Then be sure to save these new credentials for next time and create new drive instance
-AUTH.SaveCredentialsFile(CREDENTIALS)
-DRIVE = GoogleDrive(AUTH)
+    def find_folder(self, title: str) -> Optional[str]:
+        """Gets the id of a folder anywhere in the Drive by its title, or None if there is no such folder"""
 
-# Get the root folder of the database backup that we need to parent new folders to
-DATABASE_ROOT = DRIVE.ListFile({'q': "title = 'Bruh Bot Database' and trashed = false"}).GetList()[0]
+        folders = self.drive.ListFile({'q': f"title = '{title}' and trashed = false and "
+                                            f"mimeType = 'application/vnd.google-apps.folder'"}).GetList()
 
-# Iterate over everyone's meme folder to get to their memes
-for directory in os.listdir(MEMES_PATH):
+        return folders[0]['id'] if folders else None
 
-    # Query google drive and check to make sure the file is not already present
-    duplication = DRIVE.ListFile({'q': f"title = '{directory}' and trashed = false"}).GetList()
+    def list_folder(self, folder_id: str) -> Dict[str, str]:
+        """Gets the title -> id of every file in a folder"""
+        files = self.drive.ListFile({'q': f"'{folder_id}' in parents and trashed = false"}).GetList()
+        return {file['title']: file['id'] for file in files}
 
-    # If the query was empty then we have a new user and need to create a new directory for them in Google Drive
-    if not duplication:
-        folder = DRIVE.CreateFile({
-            'title': directory,
-            'parents': [{'id': DATABASE_ROOT['id']}],
+    def create_folder(self, title: str, parent_id: str) -> str:
+        """Creates a folder inside another and gets its id"""
+
+        folder = self.drive.CreateFile({
+            'title': title,
+            'parents': [{'id': parent_id}],
             'mimeType': 'application/vnd.google-apps.folder'
         })
         folder.Upload()
 
-    # Otherwise we need to just grab the pre-existing folder
+        return folder['id']
+
+    def upload(self, path: str, title: str, parent_id: str, file_id: str = None) -> str:
+        """Uploads a file into a folder, replacing the contents of an existing file if given its id, and gets its id"""
+
+        # Every file object gets its own authorized connection so uploads are safe to run from several threads
+        upload = self.drive.CreateFile({'id': file_id} if file_id else {'title': title, 'parents': [{'id': parent_id}]})
+        upload.SetContentFile(path)
+        upload.Upload()
+
+        return upload['id']
+
+
+class LocalDriveClient:
+    """
+    A stand in for Google Drive that keeps the backup in a folder on disk, with each folder or file's id being its
+    path relative to that folder. Used to try out or test the backup without touching the real Drive
+    """
+
+    def __init__(self, root: str) -> None:
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def find_folder(self, title: str) -> Optional[str]:
+        return title if (self.root / title).is_dir() else None
+
+    def list_folder(self, folder_id: str) -> Dict[str, str]:
+        return {path.name: f'{folder_id}/{path.name}' for path in (self.root / folder_id).iterdir()}
+
+    def create_folder(self, title: str, parent_id: str) -> str:
+        folder_id = f'{parent_id}/{title}' if parent_id else title
+        (self.root / folder_id).mkdir(parents=True, exist_ok=True)
+        return folder_id
+
+    def upload(self, path: str, title: str, parent_id: str, file_id: str = None) -> str:
+        file_id = file_id or f'{parent_id}/{title}'
+        shutil.copyfile(path, self.root / file_id)
+        return file_id
+
+
+def authenticate() -> PyDriveClient:
+    """Logs into Google Drive with the saved credentials, refreshing or redoing them if needed, and saves them again"""
+
+    from pydrive.drive import GoogleDrive
+    from pydrive.auth import GoogleAuth
+
+    # Create a new authentication system and attempt to load credentials from file
+    auth = GoogleAuth()
+    auth.LoadCredentialsFile(CREDENTIALS)
+
+    # If the credentials failed to load from file authenticate with teh web server
+    if auth.credentials is None:
+        auth.LocalWebserverAuth()
+
+    # If the token was just expired then refresh it and continue
+    elif auth.access_token_expired:
+        auth.Refresh()
+
+    # Otherwise just authorize like normal
+    else:
+        auth.Authorize()
+
+    # Then be sure to save these new credentials for next time and create new drive instance
+    auth.SaveCredentialsFile(CREDENTIALS)
+
+    return PyDriveClient(GoogleDrive(auth))
+
+
+def with_retries(action: Callable[[], T], attempts: int = UPLOAD_ATTEMPTS, delay: float = 1.) -> T:
+    """Runs an action, retrying it with exponential backoff and a little jitter if it raises, up to a set number of
+    attempts after which the last error is raised"""
+
+    for attempt in range(attempts):
+        try:
+            return action()
+        except Exception:
+            if attempt == attempts - 1:
+                raise
+            time.sleep(delay * 2 ** attempt * random.uniform(.5, 1.5))
+
+
+def file_hash(path: Path) -> str:
+    """Gets the SHA-256 of a file's contents"""
+
+    sha = hashlib.sha256()
+
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            sha.update(block)
+
+    return sha.hexdigest()
+
+
+def load_manifest(manifest_file: Path) -> Dict:
+    """Loads the manifest of what has already been backed up, empty if this is the first backup"""
+
+    if not manifest_file.exists():
+        return {'folders': dict(), 'files': dict()}
+
+    with open(manifest_file, 'r') as manifest:
+        return json.load(manifest)
+
+
+def save_manifest(manifest: Dict, manifest_file: Path) -> None:
+    """Atomically writes the manifest so a backup that dies part way through never leaves it half written"""
+
+    save_json(manifest_file, manifest)
+
+
+def backup_memes(drive, memes_path: str, manifest_file: Path, workers: int = UPLOAD_WORKERS) -> int:
+    """
+    Uploads every meme that is new or has changed since the last backup. Memes whose size and modification time
+    match the manifest are skipped without being read, and memes whose hash still matches are skipped without being
+    uploaded. The first time we see an author's folder we list what is already in their Drive folder once, so memes
+    backed up before there was a manifest are not uploaded again
+
+    Parameters:
+        drive - The Drive client to back up to
+        memes_path - The memes folder to back up
+        manifest_file - The manifest of what has been backed up already, updated as uploads finish
+        workers - How many memes to upload at the same time
+
+    Returns:
+        uploaded - The number of memes that were uploaded
+    """
+
+    manifest = load_manifest(manifest_file)
+    folders, files = manifest['folders'], manifest['files']
+    root_id = drive.find_folder(ROOT_FOLDER) or drive.create_folder(ROOT_FOLDER, None)
+    root_listing, pending = None, dict()
+
+    for author in sorted(entry.name for entry in os.scandir(memes_path) if entry.is_dir()):
+
+        if author not in folders:
+            root_listing = drive.list_folder(root_id) if root_listing is None else root_listing
+            folders[author] = root_listing.get(author) or drive.create_folder(author, root_id)
+            for title, file_id in drive.list_folder(folders[author]).items():
+                files.setdefault(f'{author}/{title}', {'size': None, 'mtime': None, 'sha256': None, 'id': file_id})
+
+        for entry in os.scandir(Path(memes_path, author)):
+
+            key, stat = f'{author}/{entry.name}', entry.stat()
+            known = files.get(key, dict())
+
+            if not entry.is_file() or (known.get('size'), known.get('mtime')) == (stat.st_size, stat.st_mtime_ns):
+                continue
+
+            sha = file_hash(Path(entry.path))
+
+            # Either it was only touched, or it was already in Drive before the manifest knew its hash
+            if known.get('sha256') == sha or (known.get('id') and known.get('sha256') is None):
+                files[key] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha256': sha, 'id': known['id']}
+                continue
+
+            pending[key] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha256': sha, 'id': known.get('id')}
+
+    def upload(key: str) -> str:
+        author, filename = key.split('/', 1)
+        return drive.upload(str(Path(memes_path, author, filename)), filename, folders[author], pending[key]['id'])
+
+    uploaded = 0
+
+    with ThreadPoolExecutor(workers) as pool:
+
+        uploads = {pool.submit(with_retries, lambda key=key: upload(key)): key for key in pending}
+
+        try:
+            for finished in as_completed(uploads):
+                key = uploads[finished]
+                try:
+                    files[key] = dict(pending[key], id=finished.result())
+                    uploaded += 1
+                except Exception as error:  # Leave it out of the manifest so the next run tries it again
+                    print(f'Failed to back up {key}: {error}')
+        finally:
+            save_manifest(manifest, manifest_file)
+
+    return uploaded
+
+
+def main() -> None:
+    """Backs up the memes to Google Drive, or to a local folder if one is given like --local /path/to/folder"""
+
+    if 2 < len(sys.argv) and sys.argv[1] == '--local':
+        drive = LocalDriveClient(sys.argv[2])
     else:
-        folder = duplication[0]
-
-    # Now we need to iterate over everyone's memes and upload them into their person's folder
-    for file in os.listdir(os.path.join(MEMES_PATH, directory)):
-        
-        # Query the Google Drive folder and assume this file is unique
-        file_duplication = DRIVE.ListFile({'q': f"title = '{file}' and trashed = false"}).GetList()
-        unique_file = True
-
-        # Then iterate over every parent of every matching file to make sure this file is unique
-        for duplicate_file in file_duplication:
-            for parent in duplicate_file['parents']:
-                if parent['id'] == folder['id']:
-                    unique_file = False
-
-        # If the query was empty then we know that the file needs to uploaded into their parent folder
-        if unique_file:
-            upload = DRIVE.CreateFile({'title': file, 'parents': [{'id': folder['id']}]})
-            upload.SetContentFile(os.path.join(MEMES_PATH, directory, file))
-            upload.Upload()
+        drive = authenticate()
+
+    print(f'Backed up {backup_memes(drive, MEMES_PATH, MANIFEST)} new or changed memes')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,28 +1,179 @@
-from oauth2client.service_account import ServiceAccountCredentials
 import dotenv
-import gspread
 
-import os
 import csv
+import difflib
+import hashlib
+import json
+import os
+import sys
+from pathlib import Path
+from typing import Dict, List
+
+# Make the bot's packages importable when this is run straight from crontab
+sys.path.append(str(Path(__file__).resolve().parents[1]))
 
+from commands import STATE_PATH
+from commands.persistence import save_json
+from commands.quote_store import QuoteStore
+from commands.sqlite_store import SqliteQuoteStore
 
-# Backs up the quotes.csv file to google drive daily -- schedules in crontab
+
+# Backs up the quotes.csv file to google drive daily -- schedules in crontab. A snapshot of the hash of every row as of
+# the last successful backup is kept between runs, so only the rows that were added, removed or changed are sent
 
 # Load the .env file into memory to retrieve important variables
 dotenv.load_dotenv()
 DATABASE = os.getenv('DATABASE_PATH')
+SQLITE_DATABASE = os.getenv('SQLITE_DATABASE_PATH')
+SNAPSHOT = Path(STATE_PATH, 'quote-sheet-snapshot.json')
 
 # Get the correct scope that we are working in for Google Sheets
 SCOPE = ['https://www.googleapis.com/auth/drive']
 
-# Create and log into Google Spreadsheets and open the 'College Quotes' Worksheet
-CREDENTIALS = ServiceAccountCredentials.from_json_keyfile_name(os.getenv('SECRET'), SCOPE)
-CLIENT = gspread.authorize(CREDENTIALS)
-SHEET = CLIENT.open('College Quotes').sheet1
 
-# Open up the college_quotes.csv file and parse it line by line into the correct form
-with open(DATABASE, 'r') as database:
-	CELLS = [[f'{string}' for string in line] for line in csv.reader(database)]
+class LocalWorksheet:
+    """
+    A stand in for a gspread worksheet that keeps its cells in a CSV file, implementing only the calls the backup
+    makes, with the same 1 based and inclusive row numbers. Used to try out or test the backup without Google Sheets
+    """
+
+    def __init__(self, csv_file: str) -> None:
+
+        self.csv_file = Path(csv_file)
+        self.rows: List[List[str]] = list()
+
+        if self.csv_file.exists():
+            with open(self.csv_file, 'r') as sheet:
+                self.rows = [row for row in csv.reader(sheet)]
+
+    def _save(self) -> None:
+        with open(self.csv_file, 'w') as sheet:
+            csv.writer(sheet).writerows(self.rows)
+
+    def update(self, values: List[List[str]]) -> None:
+        self.rows[:len(values)] = [list(row) for row in values]
+        self._save()
+
+    def insert_rows(self, values: List[List[str]], row: int = 1) -> None:
+        self.rows[row - 1:row - 1] = [list(cells) for cells in values]
+        self._save()
+
+    def delete_rows(self, start_index: int, end_index: int = None) -> None:
+        del self.rows[start_index - 1:end_index or start_index]
+        self._save()
+
+    def batch_update(self, data: List[Dict]) -> None:
+
+        for update in data:
+            first = int(update['range'].split(':')[0].lstrip('ABCDEFGHIJKLMNOPQRSTUVWXYZ'))
+            for offset, values in enumerate(update['values']):
+                self.rows[first - 1 + offset] = list(values)
+
+        self._save()
+
+
+def open_sheet():
+    """Logs into Google Sheets with the service account and opens the 'College Quotes' worksheet"""
+
+    from oauth2client.service_account import ServiceAccountCredentials
+    import gspread
+
+    credentials = ServiceAccountCredentials.from_json_keyfile_name(os.getenv('SECRET'), SCOPE)
+    return gspread.authorize(credentials).open('College Quotes').sheet1
+
+
+def row_hash(row: List[str]) -> str:
+    """Gets a short hash of a row's exact cells"""
+    return hashlib.blake2b('\x1f'.join(row).encode(), digest_size=8).hexdigest()
+
+
+def column(index: int) -> str:
+    """Gets the A1 notation letters of a 1 based column number"""
+
+    letters = ''
+
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+
+    return letters
+
+
+def sync_quotes(sheet, cells: List[List[str]], snapshot_file: Path) -> int:
+    """
+    Brings the worksheet up to date with the quotes database by diffing the hash of every row against the snapshot
+    of the last sync. Rows removed from the database are deleted from the sheet and rows added are inserted, working
+    from the bottom up so the row numbers of what is left to do never move, and then every changed row is rewritten
+    in a single batched update. Without a snapshot every cell is written like the first backup
+
+    Parameters:
+        sheet - The worksheet to back up to
+        cells - Every row of the quotes database
+        snapshot_file - The snapshot of the last sync, replaced once this one succeeds
+
+    Returns:
+        requests - The number of changes made to the sheet, counting the batched update once
+    """
+
+    new = [(row_hash(row), len(row)) for row in cells]
+    requests = 0
+
+    if not snapshot_file.exists():
+        sheet.update(cells)
+        requests += 1
+
+    else:
+        with open(snapshot_file, 'r') as snapshot:
+            old = [tuple(row) for row in json.load(snapshot)]
+
+        changed = list()
+        opcodes = difflib.SequenceMatcher(None, [key for key, _ in old], [key for key, _ in new],
+                                          autojunk=False).get_opcodes()
+
+        for tag, i1, i2, j1, j2 in reversed(opcodes):
+
+            # A replaced block keeps as many rows as both sides have and then deletes or inserts the rest
+            kept = min(i2 - i1, j2 - j1) if tag == 'replace' else 0
+
+            if tag in ('delete', 'replace') and i1 + kept < i2:
+                sheet.delete_rows(i1 + kept + 1, i2)
+                requests += 1
+
+            if tag in ('insert', 'replace') and j1 + kept < j2:
+                sheet.insert_rows(cells[j1 + kept:j2], row=i1 + kept + 1)
+                requests += 1
+
+            if kept:
+                # Blank out whatever was past the end of the new rows if the old ones were wider
+                width = max(width for _, width in old[i1:i1 + kept] + new[j1:j1 + kept])
+                changed.append({'range': f'A{j1 + 1}:{column(width)}{j1 + kept}',
+                                'values': [row + [''] * (width - len(row)) for row in cells[j1:j1 + kept]]})
+
+        if changed:
+            sheet.batch_update(changed)
+            requests += 1
+
+    save_json(snapshot_file, new)
+    return requests
+
+
+def main() -> None:
+    """Backs up the quotes to Google Sheets, or to a local CSV file if one is given like --local sheet.csv"""
+
+    # If the bot keeps its quotes in SQLite then export them to the database CSV first so it is up to date
+    if SQLITE_DATABASE:
+        SqliteQuoteStore(SQLITE_DATABASE).export_csv(DATABASE)
+
+    # Load the quotes database, replaying any deletes still in its journal, and put the rows into the correct form
+    cells = [[f'{string}' for string in line] for line in QuoteStore(DATABASE).rows()]
+
+    if 2 < len(sys.argv) and sys.argv[1] == '--local':
+        sheet = LocalWorksheet(sys.argv[2])
+    else:
+        sheet = open_sheet()
+
+    print(f'Backed up the quotes with {sync_quotes(sheet, cells, SNAPSHOT)} changes to the sheet')
+
 
-# Finally batch update the spreadsheet with all of the values
-SHEET.update(CELLS)
+if __name__ == '__main__':
+    main()
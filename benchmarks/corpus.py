@@ -0,0 +1,70 @@
+import csv
+import random
+from pathlib import Path
+from typing import List
+
+# Generates a synthetic quotes database and memes folder shaped like the real ones, for the benchmarks to run against
+
+WORDS = ('bruh', 'honestly', 'pickle', 'homework', 'tonight', 'never', 'again', 'why', 'would', 'you', 'do', 'that',
+         'the', 'pi', 'is', 'on', 'fire', 'uwu', 'jail', 'time', 'for', 'a', 'break', 'babe', 'stem', 'exam', 'lab')
+
+
+def author_names(count: int) -> List[str]:
+    """Gets a list of distinct title cased author names"""
+    return [f'Person {chr(ord("A") + i % 26)}{i // 26}' for i in range(count)]
+
+
+def make_quotes(csv_file: Path, rows: int, authors: List[str], rng: random.Random) -> None:
+    """
+    Writes a quotes database CSV. About one in ten quotes is a conversation with several quote/author pairs and about
+    one in ten pairs is credited to co-authors joined with ' & ', like the real database
+
+    Parameters:
+        csv_file - The CSV file to write
+        rows - How many quotes to write
+        authors - The names to credit the quotes to, earlier names get more quotes like a real group chat
+        rng - The random number generator to use
+
+    Returns:
+        Nothing
+    """
+
+    weights = [1 / (rank + 1) for rank in range(len(authors))]
+
+    with open(csv_file, 'w', newline='') as quotes:
+
+        writer = csv.writer(quotes, quoting=csv.QUOTE_ALL)
+
+        for _ in range(rows):
+
+            row = list()
+
+            for _ in range(rng.choice((2, 3)) if rng.random() < .1 else 1):
+                names = rng.choices(authors, weights, k=2 if rng.random() < .1 else 1)
+                row += [' '.join(rng.choices(WORDS, k=rng.randint(3, 14))), ' & '.join(dict.fromkeys(names))]
+
+            writer.writerow(row)
+
+
+def make_memes(memes_path: Path, memes: int, authors: List[str], rng: random.Random) -> None:
+    """
+    Fills a memes folder with a folder per author of small placeholder files, the benchmarks never decode them
+
+    Parameters:
+        memes_path - The memes folder to fill
+        memes - How many memes to make in total
+        authors - The names of the authors, their folders are lowercased like the real ones
+        rng - The random number generator to use
+
+    Returns:
+        Nothing
+    """
+
+    weights = [1 / (rank + 1) for rank in range(len(authors))]
+
+    for author in authors:
+        Path(memes_path, author.lower()).mkdir(parents=True, exist_ok=True)
+
+    for i, author in enumerate(rng.choices(authors, weights, k=memes)):
+        Path(memes_path, author.lower(), f'meme{i}.{rng.choice(("png", "jpg", "gif"))}').write_bytes(
+            bytes(rng.getrandbits(8) for _ in range(64)))
@@ -0,0 +1,229 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List
+
+# Benchmarks the bot's commands against a synthetic quotes database and memes folder, calling them with a stub
+# context that records what they send instead of talking to Discord, and saves the results as JSON so runs on the Pi
+# can be compared over time. Run it from the root of the repo like python benchmarks/run.py --quotes 100000
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+
+from benchmarks.corpus import author_names, make_memes, make_quotes
+
+
+class StubUser:
+    """Stands in for the discord user who sent a command"""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.mention = f'@{name}'
+
+
+class StubMessage:
+    """Stands in for the discord message a command was sent in"""
+
+    def __init__(self, author: str) -> None:
+        self.author = StubUser(author)
+        self.attachments = list()
+        self.mentions = list()
+
+
+class StubChannel:
+    """Stands in for the discord channel a command was sent in, keeping count of what would have been sent"""
+
+    name = 'bench'
+
+    def __init__(self) -> None:
+        self.messages = 0
+        self.files = 0
+
+    async def send(self, content: str = None, file=None, **_) -> None:
+        self.messages += 1
+        self.files += file is not None
+
+
+class StubContext:
+    """Stands in for the context a command is invoked with"""
+
+    def __init__(self, author: str = 'Bob the Great') -> None:
+        self.channel = StubChannel()
+        self.message = StubMessage(author)
+        self.guild = None
+
+
+def percentile(latencies: List[float], q: float) -> float:
+    """Gets a percentile of a sorted list of latencies, using the nearest rank"""
+    return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+
+async def measure(runs: int, action: Callable[[int], Awaitable]) -> Dict[str, float]:
+    """
+    Runs an action a number of times one after the other, timing each run
+
+    Parameters:
+        runs - How many times to run the action
+        action - The coroutine function to time, given the number of the run
+
+    Returns:
+        result - The number of runs, their throughput per second and their mean, p50 and p99 latency in milliseconds
+    """
+
+    latencies = list()
+
+    for run in range(runs):
+        start = time.perf_counter()
+        await action(run)
+        latencies.append(time.perf_counter() - start)
+
+    latencies.sort()
+
+    return {'runs': runs, 'throughput': runs / sum(latencies), 'mean_ms': sum(latencies) / runs * 1000,
+            'p50_ms': percentile(latencies, .5) * 1000, 'p99_ms': percentile(latencies, .99) * 1000}
+
+
+async def benchmark(runs: int, chart_runs: int, authors: List[str]) -> Dict[str, Dict[str, float]]:
+    """Times every benchmarked command and helper, the commands are imported here since they load the corpus"""
+
+    from commands import leaderboard, memes, quotes
+    from commands.scoreboard import SCOREBOARD
+
+    rng = random.Random(0)
+    results = dict()
+
+    # Build the phrase search index the way the bot does once it connects, so it is not timed as part of a search
+    await quotes.build_search_index()
+    if quotes.SEARCH_INDEX is not None:
+        await quotes.SEARCH_INDEX
+
+    async def quote_by(_):
+        quotes.next_quote_by(rng.choice(authors))
+
+    async def quote_command(_):
+        await quotes.get_quote.callback(StubContext(), rng.choice(authors))
+
+    async def closest_quote(_):
+        await quotes.get_quote.callback(StubContext(), rng.choice(authors), 'pickle homework tonite')
+
+    async def save_quote(run):
+        await quotes.save_quote.callback(StubContext(), f'benchmark quote number {run}', authors[0])
+
+    async def remove_quote(run):
+        await quotes.remove_quote.callback(StubContext(), f'benchmark quote number {run}', authors[0])
+
+    async def meme_command(_):
+        await memes.get_meme.callback(StubContext())
+
+    async def statistics(_):
+        leaderboard.get_statistics_dict()
+
+    async def scoreboard_rebuild(_):
+        SCOREBOARD.rebuild(quotes.QUOTES.rows(), memes.MEMES.counts())
+
+    async def leaderboard_render(_):
+        leaderboard.LEADERBOARD_CACHE.clear()
+        await leaderboard.get_statistics.callback(StubContext())
+
+    async def leaderboard_cached(_):
+        await leaderboard.get_statistics.callback(StubContext())
+
+    results['next_quote_by'] = await measure(runs, quote_by)
+    results['$quote'] = await measure(runs, quote_command)
+    results['$quote phrase'] = await measure(runs, closest_quote)
+    results['$add-quote'] = await measure(runs, save_quote)
+    results['$delete-quote'] = await measure(runs, remove_quote)  # Removes the quotes that were just added
+    results['$meme'] = await measure(runs, meme_command)
+    results['get_statistics_dict'] = await measure(runs, statistics)
+    results['scoreboard rebuild'] = await measure(max(1, runs // 10), scoreboard_rebuild)
+    results['$leaderboard render'] = await measure(chart_runs, leaderboard_render)
+    results['$leaderboard cached'] = await measure(runs, leaderboard_cached)
+
+    return results
+
+
+def git_commit() -> str:
+    """Gets the commit the benchmarks are running against, if this is a git checkout"""
+
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ''
+
+
+def main() -> None:
+    """Builds the synthetic corpus, points the bot at it, runs the benchmarks and saves the results"""
+
+    parser = argparse.ArgumentParser(description='Benchmarks the bot commands offline against a synthetic corpus')
+    parser.add_argument('--quotes', type=int, default=10000, help='how many quotes to generate')
+    parser.add_argument('--memes', type=int, default=2000, help='how many memes to generate')
+    parser.add_argument('--authors', type=int, default=40, help='how many people to spread them over')
+    parser.add_argument('--runs', type=int, default=200, help='how many times to run each command')
+    parser.add_argument('--chart-runs', type=int, default=5, help='how many times to render the leaderboard')
+    parser.add_argument('--sqlite', action='store_true', help='keep the quotes in SQLite instead of the CSV')
+    parser.add_argument('--output', help='where to save the results, by default benchmarks/results/<time>.json')
+    args = parser.parse_args()
+
+    workspace = Path(tempfile.mkdtemp(prefix='bot-benchmark-'))
+    authors = author_names(args.authors)
+    rng = random.Random(0)
+
+    start = time.perf_counter()
+    make_quotes(workspace / 'quotes.csv', args.quotes, authors, rng)
+    make_memes(workspace / 'memes', args.memes, authors, rng)
+    print(f'Generated the corpus in {workspace} in {time.perf_counter() - start:.1f}s')
+
+    # Set everything the bot reads from the .env file so nothing points at the real database
+    os.environ.update(DATABASE_PATH=str(workspace / 'quotes.csv'), MEMES_FOLDER=str(workspace / 'memes'),
+                      RESOURCE_FOLDER=str(workspace), STATE_FOLDER=str(workspace), CHANNEL_LOCK='bench',
+                      SQLITE_DATABASE_PATH=str(workspace / 'quotes.sqlite') if args.sqlite else '',
+                      MEME_VARIANTS_FOLDER='', METRICS_FILE='')
+
+    start = time.perf_counter()
+    import commands.leaderboard  # Loads the quotes database and scans the memes folder
+    load_seconds = time.perf_counter() - start
+
+    results = asyncio.get_event_loop().run_until_complete(benchmark(args.runs, args.chart_runs, authors))
+
+    # Stop the chart workers so they are reaped, which is when their peak memory is counted for the children
+    if commands.leaderboard.CHART_POOL is not None:
+        commands.leaderboard.CHART_POOL.shutdown(wait=True)
+
+    report = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'corpus': {'quotes': args.quotes, 'memes': args.memes, 'authors': args.authors, 'sqlite': args.sqlite},
+        'load_seconds': load_seconds,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'chart_worker_peak_rss_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,  # The largest one
+        'results': results,
+    }
+
+    output = Path(args.output or ROOT / 'benchmarks' / 'results' / f'{time.strftime("%Y%m%d-%H%M%S")}.json')
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+
+    print(f'Loaded the bot in {load_seconds:.2f}s, peak memory {report["peak_rss_mb"]:.1f} MB, '
+          f'{report["chart_worker_peak_rss_mb"]:.1f} MB in the largest chart worker')
+    for name, result in results.items():
+        print(f'{name:>22}: {result["throughput"]:10.1f}/s  '
+              f'p50 {result["p50_ms"]:8.2f}ms  p99 {result["p99_ms"]:8.2f}ms')
+    print(f'Saved the results to {output}')
+
+    shutil.rmtree(workspace, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+import io
+from typing import List
+
+# Chart rendering runs in worker processes, see render_chart in commands/leaderboard.py, so these functions only take
+# and return plain data and import matplotlib themselves with the headless Agg backend. This lives outside the commands
+# package so the workers do not import discord.py and build a second bot just to draw a chart
+
+
+def _pyplot():
+    """Imports pyplot for the worker process using the headless Agg backend"""
+
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    return plt
+
+
+def render_pie_chart(authors: List[str], contributions: List[int], content_type: str) -> bytes:
+    """
+    Takes in a list of authors and their corresponding counts for quotes/memes and creates a nice and pretty pie
+    chart from this for fun. Most of the styling for this graph was taken form the website below.
+
+    Parameters:
+        authors - A list of strings of all of the authors in the server
+        contributions - A list of numbers of their total contribution count to the server
+        content_type - The type of content this is counting so either memes or quotes
+
+    Returns:
+        image - The rendered pie chart as PNG bytes
+
+    References:
+        https://medium.com/@kvnamipara/a-better-visualisation-of-pie-charts-by-matplotlib-935b7667d77f
+    """
+
+    plt = _pyplot()
+
+    slice_colors = ['#7fe5f0', '#407294', '#ff7373', '#8a2be2', '#7fffd4', '#ffd700', '#5ac18e',
+                    '#947fff', '#f0f0f0', '#f190c1', '#f9ae54', '#bb6c5d', '#924431', '#2e465e',
+                    '#fadb6a', '#4dacb4', '#6b724', '#d28a2d']
+
+    fig1, ax1 = plt.subplots()
+    ax1.pie(contributions, colors=slice_colors, labels=authors, autopct='%1.1f%%', startangle=90,
+            pctdistance=0.85, labeldistance=1.05, textprops={'fontsize': 19})
+    centre_circle = plt.Circle((0, 0), 0.70, fc='white')
+
+    plt.title(f'Total {content_type} Contributions', pad=20, fontweight='bold', fontsize=30)
+
+    fig = plt.gcf()
+    fig.gca().add_artist(centre_circle)
+    fig.set_size_inches(18., 14.)
+    ax1.axis('equal')
+    plt.tight_layout()
+
+    image = io.BytesIO()
+    plt.savefig(image, format='png')
+    plt.close(fig)
+
+    return image.getvalue()
+
+
+def render_scoreboard(authors: List[str], quotes: List[int], memes: List[int]) -> bytes:
+    """
+    Draws the bar graph version of the scoreboard, with a bar for the number of memes and a bar for the number of
+    quotes of every author, in the order they are given
+
+    Parameters:
+        authors - A list of the names of the authors to draw, bottom to top
+        quotes - The number of quotes of each author
+        memes - The number of memes of each author
+
+    Returns:
+        image - The rendered bar graph as PNG bytes
+    """
+
+    import numpy as np
+    plt = _pyplot()
+
+    meme_column = np.arange(len(authors))
+    quotes_column = meme_column + .25
+
+    fig, ax = plt.subplots()
+
+    ax.barh(meme_column, memes, color='#1f85de', height=.25, edgecolor='white', label='Memes')
+    ax.barh(quotes_column, quotes, color='#f33b2f', height=.25, edgecolor='white', label='Quotes')
+
+    plt.xlabel('Count', labelpad=15, fontweight='bold', fontsize=20)
+    plt.ylabel('People', labelpad=15, fontweight='bold', fontsize=20)
+
+    plt.xticks(fontsize=15)
+    plt.yticks(meme_column + .125, authors, fontsize=15)
+    plt.title('Bruh Bot Scoreboard', pad=15, fontweight='bold', fontsize=30)
+
+    ax.spines['top'].set_visible(False)
+    ax.spines['right'].set_visible(False)
+    ax.spines['bottom'].set_visible(False)
+    ax.spines['left'].set_color('#DDDDDD')
+
+    ax.tick_params(bottom=False, left=False)
+
+    ax.set_axisbelow(True)
+    ax.xaxis.grid(True, color='#EEEEEE')
+    ax.yaxis.grid(False)
+
+    fig.set_size_inches(18., 14.)
+    fig.tight_layout()
+
+    plt.legend()
+
+    image = io.BytesIO()
+    plt.savefig(image, format='png')
+    plt.close(fig)
+
+    return image.getvalue()
@@ -1,7 +1,15 @@
+import importlib
 import os
+import resource
+import time
 import dotenv
+from pathlib import Path
 from discord.ext import commands
 
+from commands.persistence import flush_pending_saves
+
+
+STARTED = time.perf_counter()  # When the commands started loading, for the startup timing report
 
 # Create a new bot with the prefix of '$' for commands
 BOT = commands.Bot(command_prefix='$')
@@ -15,11 +23,27 @@ CSV_FILE = os.getenv('DATABASE_PATH')
 MEMES_PATH = os.getenv('MEMES_FOLDER')
 RESOURCES_PATH = os.getenv('RESOURCE_FOLDER')
 
+# Optionally keep recompressed copies of the memes in this folder so they are quicker to send
+VARIANTS_PATH = os.getenv('MEME_VARIANTS_FOLDER')
+
+# How $meme picks a random meme, 'uniform' gives every meme the same chance and 'author' every person the same chance
+MEME_SAMPLING = os.getenv('MEME_SAMPLING', 'uniform')
+
+# Get the folder to keep the bot's own state files in, by default the same folder as the database
+STATE_PATH = os.getenv('STATE_FOLDER') or str(Path(CSV_FILE or '.').resolve().parent)
+
+# Optionally keep the quotes in SQLite instead, the first run imports the quotes from the database CSV
+SQLITE_FILE = os.getenv('SQLITE_DATABASE_PATH')
+
+# Optionally write the command timings to this file in the Prometheus text format
+METRICS_FILE = os.getenv('METRICS_FILE')
+
 # Get the channel that we are locking the bot to
 CHANNEL_LOCK = os.getenv('CHANNEL_LOCK')
 
-# Get the filename of the leaderboard image to send in the chat
-TEMP_FILE_NAME = os.getenv('LEADERBOARD_NAME')
+# Get the cron expressions of when to send each of the reminders, a reminder without one is never sent
+REMINDER_SCHEDULES = {'Break': os.getenv('BREAK_SCHEDULE'), 'Checkin': os.getenv('CHECKIN_SCHEDULE'),
+                      'Daily': os.getenv('DAILY_SCHEDULE')}
 
 
 def lock_to_channel(channel):
@@ -28,6 +52,28 @@ def lock_to_channel(channel):
 
 
 def start_bot():
-    """Short function to import all of the commands packages to add the commands to the bot then run the bot"""
-    from . import deputy, leaderboard, memes, miscellaneous, quotes
-    BOT.run(TOKEN)
+    """Short function to import all of the commands packages to add the commands to the bot then run the bot. How
+    long each one took to load is printed so a slow import is easy to spot, python -X importtime gives the details"""
+
+    # The modules the others import come first, so each one's time is only its own
+    for module in ('quotes', 'memes', 'deputy', 'miscellaneous', 'reminders', 'leaderboard'):
+        start = time.perf_counter()
+        importlib.import_module(f'{__name__}.{module}')
+        print(f'Loaded {module} commands in {time.perf_counter() - start:.3f}s')
+
+    # Stopping the bot drops whatever the event loop still had scheduled, including the saves waiting to run
+    try:
+        BOT.run(TOKEN)
+    finally:
+        flush_pending_saves()
+
+
+@BOT.listen('on_ready')
+async def report_startup() -> None:
+    """Prints how long the bot took to come online and how much memory it needed to get there, only the first time
+    since on_ready fires again whenever the bot reconnects to Discord"""
+
+    BOT.remove_listener(report_startup, 'on_ready')
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # Linux reports this in kilobytes
+    print(f'Ready {time.perf_counter() - STARTED:.3f}s after the commands started loading, '
+          f'peak memory {peak_memory:.1f} MB')
@@ -2,9 +2,125 @@ import discord
 
 import asyncio
 import random
+from collections import defaultdict
 from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
 
 from commands import *
+from commands.timers import TimerHeap
+
+SENTENCE = 300  # How many seconds someone spends in uwu jail
+
+JAILS: Dict[int, Tuple[discord.Role, discord.TextChannel]] = dict()  # Server id -> its uwu jail role and channel
+
+# Limits how many role changes we have in flight at once, discord.py waits out any rate limits we still run into
+ROLE_CHANGES = asyncio.Semaphore(5)
+
+
+def jail_of(guild: discord.Guild) -> Tuple[discord.Role, discord.TextChannel]:
+    """Gets the uwu jail role and channel of a server, only searching its roles and channels the first time"""
+
+    if guild.id not in JAILS:
+        JAILS[guild.id] = (discord.utils.find(lambda r: r.name == 'uwu-jail', guild.roles),
+                           discord.utils.find(lambda c: c.name == 'uwu-jail', guild.channels))
+
+    return JAILS[guild.id]
+
+
+@BOT.listen('on_guild_update')
+@BOT.listen('on_guild_remove')
+@BOT.listen('on_guild_role_create')
+@BOT.listen('on_guild_role_delete')
+@BOT.listen('on_guild_role_update')
+@BOT.listen('on_guild_channel_create')
+@BOT.listen('on_guild_channel_delete')
+@BOT.listen('on_guild_channel_update')
+async def forget_jail(changed, *_) -> None:
+    """Forgets a server's jail whenever the server or one of its roles or channels changes, so it is looked up again"""
+    JAILS.pop(getattr(changed, 'guild', changed).id, None)
+
+
+async def change_roles(user_ids: Iterable[int], role: discord.Role, add: bool) -> List[int]:
+    """
+    Gives or takes away a role from a group of users, with the requests sent concurrently rather than in turn. The
+    users are changed by id so they do not need to be in the member cache, which without the members intent only holds
+    people in voice channels, and taking the role from someone who has left the server counts as done
+
+    Parameters:
+        user_ids - The ids of the users to change the role of
+        role - The role to give or take away
+        add - If the role is being given rather than taken away
+
+    Returns:
+        failed - The ids of the users whose role could not be changed
+    """
+
+    change = BOT.http.add_role if add else BOT.http.remove_role
+
+    async def change_role(user_id: int) -> None:
+        async with ROLE_CHANGES:
+            try:
+                await change(role.guild.id, user_id, role.id)
+            except discord.NotFound:
+                if add:
+                    raise
+
+    user_ids = list(user_ids)
+    results = await asyncio.gather(*[change_role(user_id) for user_id in user_ids], return_exceptions=True)
+
+    for user_id, result in zip(user_ids, results):
+        if isinstance(result, Exception):
+            print(f'Could not {"give" if add else "take"} the {role.name} role {"to" if add else "from"} {user_id}: '
+                  f'{result!r}')
+
+    return [user_id for user_id, result in zip(user_ids, results) if isinstance(result, Exception)]
+
+
+async def release_inmates(inmates: List[List[int]]) -> List[List[int]]:
+    """
+    Lets out everyone whose sentence is up, all at once per server, so a crowd of arrests that end together only
+    gets one release message and one purge of the jail channel
+
+    Parameters:
+        inmates - The [server id, user id] of everyone to release
+
+    Returns:
+        failed - The [server id, user id] of everyone who could not be let out, to try again later
+    """
+
+    servers = defaultdict(set)
+    failed = list()
+
+    for guild_id, user_id in inmates:
+        servers[guild_id].add(user_id)
+
+    for guild_id, user_ids in servers.items():
+
+        guild = BOT.get_guild(guild_id)
+
+        if guild is None:  # We were removed from the server while they were in jail
+            continue
+
+        inmate_role, inmate_channel = jail_of(guild)
+
+        await inmate_channel.send(f"Your time is up inmate. Go back and be a productive member of the server.")
+        await asyncio.sleep(3)
+
+        failed += [[guild_id, user_id] for user_id in await change_roles(user_ids, inmate_role, add=False)]
+
+        await inmate_channel.purge()
+
+    return failed
+
+
+# Everyone still serving their sentence, kept on disk so they are let out on time even if the bot restarts
+JAIL_TIMERS = TimerHeap(str(Path(STATE_PATH, 'jail-timers.json')), release_inmates)
+
+
+@BOT.listen('on_ready')
+async def resume_sentences() -> None:
+    """Starts releasing inmates once we are connected, including anyone whose sentence ran out while we were down"""
+    JAIL_TIMERS.start()
 
 
 @BOT.command(name='parole', brief='Forces a release of all prisoners in uwu jail if anyone abuses it or a malfunction '
@@ -26,15 +142,18 @@ async def release_prisoners(ctx) -> None:
         await ctx.channel.send(f"Nice try, {ctx.message.author.mention}, but this is only for emergencies")
         return
 
-    inmate_role = discord.utils.find(lambda r: r.name == 'uwu-jail', ctx.guild.roles)
-    inmate_channel = discord.utils.find(lambda c: c.name == 'uwu-jail', ctx.guild.channels)
+    inmate_role, inmate_channel = jail_of(ctx.guild)
     user_mentions = ', '.join([user.mention for user in ctx.message.mentions])
 
     await inmate_channel.send(f"{user_mentions} you're being let out early for good behavior. Dont make me regret it")
     await asyncio.sleep(3)
 
-    for user in ctx.message.mentions:
-        await user.remove_roles(inmate_role)
+    paroled = {user.id for user in ctx.message.mentions}
+    JAIL_TIMERS.cancel(lambda inmate: inmate[0] == ctx.guild.id and inmate[1] in paroled)
+
+    # Anyone we could not let out is handed to the release timers, which keep trying until it works
+    for user_id in await change_roles(paroled, inmate_role, add=False):
+        JAIL_TIMERS.schedule(0, [ctx.guild.id, user_id])
 
     await inmate_channel.purge()
 
@@ -42,8 +161,8 @@ async def release_prisoners(ctx) -> None:
 @BOT.command(name='arrest', brief='Sends the mentioned users to the uwu jail for 5 minutes and then auto releases them')
 async def detain_prisoners(ctx) -> None:
     """
-    Moves the mentioned people into the restricted group for 5 minutes and then automatically let them out if
-    everything goes as planned. You must type in $arrest and then mention all users you want to send to the jail
+    Moves the mentioned people into the restricted group for 5 minutes and then automatically let them out, even if
+    the bot restarts in the meantime. You must type in $arrest and then mention all users you want to send to the jail
     channel for this to work.
 
     Parameters:
@@ -53,14 +172,29 @@ async def detain_prisoners(ctx) -> None:
         Nothing
     """
 
-    inmate_role = discord.utils.find(lambda r: r.name == 'uwu-jail', ctx.guild.roles)
-    inmate_channel = discord.utils.find(lambda c: c.name == 'uwu-jail', ctx.guild.channels)
-    user_mentions, screen_names = list(), list()
+    inmate_role, inmate_channel = jail_of(ctx.guild)
+
+    # Arresting someone already in jail starts their sentence over. Their release is scheduled before they are given
+    # the role, so nobody can end up in jail without a way out
+    arrested = {user.id for user in ctx.message.mentions}
+    JAIL_TIMERS.cancel(lambda inmate: inmate[0] == ctx.guild.id and inmate[1] in arrested)
+
+    for user_id in arrested:
+        JAIL_TIMERS.schedule(SENTENCE, [ctx.guild.id, user_id])
+
+    failed = set(await change_roles(arrested, inmate_role, add=True))
+    inmates = [user for user in ctx.message.mentions if user.id not in failed]
+
+    # The release timers of anyone who escaped are left alone, taking away a role someone does not have is harmless
+    if failed:
+        escaped = [user.mention for user in ctx.message.mentions if user.id in failed]
+        await ctx.channel.send(f'Could not send {", ".join(escaped)} to uwu jail, they escaped this time.')
 
-    for user in ctx.message.mentions:
-        user_mentions.append(user.mention)
-        screen_names.append(user.name)
-        await user.add_roles(inmate_role)
+    if not inmates:
+        return
+
+    user_mentions = [user.mention for user in inmates]
+    screen_names = [user.name for user in inmates]
 
     await ctx.channel.send(f'Users {", ".join(user_mentions)} have been sent to uwu jail for their crimes against '
                            f'humanity. You can rest easy now.')
@@ -75,12 +209,3 @@ async def detain_prisoners(ctx) -> None:
     await inmate_channel.send(file=image_file)
     await inmate_channel.send(f'{", ".join(user_mentions)} you are in uwu jail. You can leave when your uwu levels '
                               f'subside in approximately 5 minutes.')
-    await asyncio.sleep(300)
-
-    await inmate_channel.send(f"Your time is up inmate. Go back and be a productive member of the server.")
-    await asyncio.sleep(3)
-
-    for user in ctx.message.mentions:
-        await user.remove_roles(inmate_role)
-
-    await inmate_channel.purge()
@@ -0,0 +1,138 @@
+import re
+from collections import Counter, defaultdict
+from heapq import nlargest
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+Quote = Tuple[str, ...]  # A quote row of the form (quote, author, quote, author, ...)
+
+
+def normalize(text: str) -> str:
+    """Lowercases a string and replaces everything but letters and numbers with single spaces, like fuzzywuzzy does"""
+    return ' '.join(re.sub(r'\W+', ' ', text).lower().split())
+
+
+def trigrams(text: str) -> Set[str]:
+    """Gets the set of character trigrams of every word in a normalized string, padded so short words still count"""
+    return {word[i:i + 3] for word in (f'  {token} ' for token in text.split()) for i in range(len(word) - 2)}
+
+
+def quote_text(quote: Quote) -> str:
+    """Joins the quote halves of every quote/author pair into the normalized text we match phrases against"""
+    return normalize(' '.join(quote[0::2]))
+
+
+def best_match(phrase: str, texts: List[str]) -> Optional[int]:
+    """
+    Scores a phrase against every candidate text with the token set ratio and gets the position of the best one,
+    the first one wins in the case of a tie. Uses rapidfuzz when it is installed since it is much faster
+
+    Parameters:
+        phrase - The phrase we are trying to find the closest text to
+        texts - The normalized candidate texts to score
+
+    Returns:
+        index - The position of the best scoring text, or None if there were no texts
+    """
+
+    if not texts:
+        return None
+
+    # Imported on the first phrase search rather than when the bot starts, since most quote requests never need it
+    try:
+        from rapidfuzz import fuzz, process
+    except ImportError:  # Fall back to the pure python scorer if rapidfuzz is not installed
+        from fuzzywuzzy import fuzz
+        process = None
+
+    if process is not None:
+        return process.extractOne(normalize(phrase), texts, scorer=fuzz.token_set_ratio, processor=None)[2]
+
+    return max(range(len(texts)), key=lambda i: fuzz.token_set_ratio(texts[i], phrase))
+
+
+class FuzzyIndex:
+    """
+    A precomputed search index over the text of every quote so that a phrase search only has to run the expensive
+    fuzzy ratio on a handful of likely candidates. For every quote we keep its normalized text, its token set and its
+    trigram count, and we keep an inverted index of trigram -> row ids. Candidates are ranked by how many trigrams and
+    tokens they share with the phrase, which tolerates typos, and only the top few are fuzzy scored.
+    """
+
+    def __init__(self, top_k: int = 25) -> None:
+
+        self.top_k = top_k
+        self._texts: Dict[int, str] = dict()
+        self._tokens: Dict[int, FrozenSet[str]] = dict()
+        self._sizes: Dict[int, int] = dict()
+        self._trigrams: Dict[str, Set[int]] = defaultdict(set)
+
+    def add(self, row_id: int, quote: Quote) -> None:
+        """Indexes the text of a new quote under its row id"""
+
+        text = quote_text(quote)
+        grams = trigrams(text)
+
+        self._texts[row_id] = text
+        self._tokens[row_id] = frozenset(text.split())
+        self._sizes[row_id] = len(grams)
+
+        for gram in grams:
+            self._trigrams[gram].add(row_id)
+
+    def remove(self, row_id: int) -> None:
+        """Removes a deleted quote from the index"""
+
+        for gram in trigrams(self._texts.pop(row_id)):
+            self._trigrams[gram].discard(row_id)
+            if not self._trigrams[gram]:
+                del self._trigrams[gram]
+
+        del self._tokens[row_id]
+        del self._sizes[row_id]
+
+    def candidates(self, phrase: str, row_ids: Iterable[int] = None) -> List[int]:
+        """
+        Gets the row ids of the quotes most similar to a phrase according to their shared trigrams and tokens
+
+        Parameters:
+            phrase - The phrase we are trying to find the closest quote to
+            row_ids - The row ids to restrict the search to, or None to search every quote
+
+        Returns:
+            row_ids - At most top_k row ids, most similar first
+        """
+
+        allowed = None if row_ids is None else set(row_ids)
+        text = normalize(phrase)
+        grams, tokens = trigrams(text), set(text.split())
+        shared = Counter()
+
+        for gram in grams:
+            postings = self._trigrams.get(gram, ())
+            shared.update(postings if allowed is None else allowed.intersection(postings))
+
+        def similarity(row_id: int) -> Tuple[float, float]:
+            dice = 2 * shared[row_id] / (len(grams) + self._sizes[row_id])
+            return dice + len(tokens & self._tokens[row_id]) / (len(tokens) or 1), -row_id
+
+        return nlargest(self.top_k, shared, key=similarity)
+
+    def closest(self, phrase: str, row_ids: Iterable[int] = None) -> Optional[int]:
+        """
+        Gets the row id of the quote that best matches a phrase, fuzzy scoring only the top candidates. If no quote
+        shares so much as a trigram with the phrase every allowed quote is scored instead
+
+        Parameters:
+            phrase - The phrase we are trying to find the closest quote to
+            row_ids - The row ids to restrict the search to, or None to search every quote
+
+        Returns:
+            row_id - The id of the closest quote, or None if there are no quotes to search
+        """
+
+        restrict = None if row_ids is None else sorted(row_ids)
+        pool = list(self._texts) if restrict is None else restrict
+        shortlist = pool if len(pool) <= self.top_k else self.candidates(phrase, restrict) or pool
+        best = best_match(phrase, [self._texts[row_id] for row_id in shortlist])
+
+        return None if best is None else shortlist[best]
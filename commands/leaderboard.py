@@ -1,22 +1,79 @@
 import discord
 
-import csv
-from collections import defaultdict
+import asyncio
+import io
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from heapq import nlargest
-from typing import Dict, Tuple, List
-from pathlib import Path
-
-import matplotlib.pyplot as plt
-import numpy as np
+from typing import Callable, Dict, List, Optional, Tuple
 
+from charts import render_pie_chart, render_scoreboard
 from commands import *
+from commands.memes import MEMES
+from commands.metrics import METRICS
+from commands.output import send_paginated
+from commands.quotes import QUOTES
+from commands.scoreboard import SCOREBOARD
+
+CHART_WORKERS = 2                                  # How many charts can be rendered at the same time
+CHART_SLOTS = asyncio.Semaphore(CHART_WORKERS)     # Queues up any leaderboard requests past that many
+CHART_POOL = None                                  # The worker processes, started on the first leaderboard request
+
+LEADERBOARD_CACHE_SIZE = 16                        # How many different leaderboard queries we keep the images of
+LEADERBOARD_CACHE: 'OrderedDict[tuple, List[Tuple[str, bytes]]]' = OrderedDict()  # (version, args) -> images
+
+
+async def render_chart(renderer: Callable[..., bytes], *data) -> bytes:
+    """
+    Renders a chart in one of the worker processes so that matplotlib never blocks the event loop, and with it every
+    other command and the gateway heartbeat. The renderer is given plain scoreboard data and returns PNG bytes
+
+    Parameters:
+        renderer - The chart function from the top level charts.py to run
+        data - The plain data to pass to the chart function
+
+    Returns:
+        image - The rendered chart as PNG bytes
+    """
+
+    global CHART_POOL  # Make sure we can start the worker processes if this is the first chart
+
+    async with CHART_SLOTS:
+        with METRICS.span(f'charts.{renderer.__name__}'):
+            for attempt in range(2):
+
+                if CHART_POOL is None:
+                    CHART_POOL = ProcessPoolExecutor(CHART_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+
+                pool = CHART_POOL
+
+                try:
+                    return await asyncio.get_event_loop().run_in_executor(pool, renderer, *data)
+                except BrokenProcessPool:
+                    # A worker died, say the Pi ran out of memory, which breaks the whole pool so start a new one
+                    if CHART_POOL is pool:
+                        CHART_POOL = None
+                        pool.shutdown(wait=False)
+                    if attempt:
+                        raise
+
+
+def data_version() -> Tuple[int, int]:
+    """Gets the current version of the quotes and memes databases, which changes whenever either is added to or
+    deleted from, so a leaderboard rendered at one version is still correct for as long as the version is the same"""
+
+    MEMES.refresh()
+    return QUOTES.version, MEMES.version
 
 
 def get_statistics_dict() -> Dict[str, Tuple[int, int]]:
     """
     Get the total count of each person's quotes and memes in the database as a dictionary of the form
     Name -> (# Quotes, # Memes) so that this can then be used by the scoreboard functions to make pretty matplotlib
-    graphs to send in the chat
+    graphs to send in the chat. The counts come from the running scoreboard, and only if it was counted from a
+    database of a different size, say because memes were copied in by hand, do we recount the stale half of it
 
     Parameters:
         Nothing
@@ -25,21 +82,50 @@ def get_statistics_dict() -> Dict[str, Tuple[int, int]]:
         scoreboard - A dictionary linking all peoples names to a tuples of (# Quotes, # Memes) counters
     """
 
-    scoreboard = defaultdict(lambda: (0, 0))
+    with METRICS.span('leaderboard.get_statistics_dict'):
 
-    with open(CSV_FILE, 'r') as college_quotes:
+        meme_counts = MEMES.counts()
+        quotes_in_sync, memes_in_sync = SCOREBOARD.in_sync(len(QUOTES), sum(meme_counts.values()))
 
-        for quote in csv.reader(college_quotes):
-            for index in range(1, len(quote), 2):
-                for author in quote[index].split(' & '):
-                    quotes, memes = scoreboard[author]
-                    scoreboard[author] = quotes + 1, memes
+        if not quotes_in_sync:
+            SCOREBOARD.count_quotes(QUOTES.rows())
 
-    for author in Path(MEMES_PATH).iterdir():
-        quotes, memes = scoreboard[author.stem.title()]
-        scoreboard[author.stem.title()] = quotes, len(list(author.iterdir()))
+        if not memes_in_sync:
+            SCOREBOARD.count_memes(meme_counts)
 
-    return scoreboard
+        return SCOREBOARD.scores()
+
+
+@BOT.command(name='verify-scoreboard', brief='Recounts the leaderboard from scratch and reports any drift')
+@lock_to_channel(CHANNEL_LOCK)
+async def verify_scoreboard(ctx) -> None:
+    """
+    Recounts everyone's quotes and memes from the whole database and replaces the running scoreboard with the new
+    counts, then reports everyone whose count had drifted. This is a privileged action since it reads the entire
+    database, so only the admins can use it.
+
+    Parameters:
+        ctx - The context from which this command was send
+
+    Returns:
+        Nothing
+    """
+
+    if ctx.message.author.name != 'Bob the Great':
+        await ctx.channel.send(f"Nice try, {ctx.message.author.mention}, but this is only for emergencies")
+        return
+
+    drift = SCOREBOARD.rebuild(QUOTES.rows(), MEMES.counts())
+
+    if not drift:
+        await ctx.channel.send('The scoreboard matches the database, nothing has drifted.')
+        return
+
+    LEADERBOARD_CACHE.clear()  # The cached charts were drawn from the drifted counts
+
+    await send_paginated(ctx.channel, (f'{name}: {before[0]} -> {after[0]} quotes, {before[1]} -> {after[1]} memes'
+                                       for name, (before, after) in drift.items()),
+                         header=f'Recounted the scoreboard, {len(drift)} counters had drifted:')
 
 
 @BOT.command(name='leaderboard', brief='Sends the overall number of memes/quotes associated with each person')
@@ -61,76 +147,73 @@ async def get_statistics(ctx, *args) -> None:
         Nothing
     """
 
-    scoreboard_info = get_statistics_dict()  # Get the scoreboard in the form Name -> (# Quotes, # Memes)
+    # The same query against the same version of the databases always draws the same charts, so reuse them if we can
+    version = data_version()
+    images = LEADERBOARD_CACHE.get((version, args))
 
-    if len(args) == 0:
-        await send_leaderboard_image(ctx, scoreboard_info)
+    if images is not None:
+        LEADERBOARD_CACHE.move_to_end((version, args))
 
-    elif args[0] == 'pie':
-        await pie_chart_scoreboard(ctx, scoreboard_info)
+    else:
+        images = await render_leaderboard(args)
 
-    elif len(args) == 1 and args[0].isdigit():
-        await send_leaderboard_image(ctx, scoreboard_info, top_n_authors=int(args[0]))
+        if images is None:
+            await ctx.channel.send("Malformed leaderboard query, cannot complete request")
+            return
 
-    elif all([name.title() in scoreboard_info for name in args]):
-        await send_leaderboard_image(ctx, scoreboard_info, requested_authors=args)
+        # Charts from older versions can never be asked for again, so drop them before making room for these
+        for stale in [key for key in LEADERBOARD_CACHE if key[0] != version]:
+            del LEADERBOARD_CACHE[stale]
 
-    else:
-        await ctx.channel.send("Malformed leaderboard query, cannot complete request")
+        LEADERBOARD_CACHE[(version, args)] = images
+        if len(LEADERBOARD_CACHE) > LEADERBOARD_CACHE_SIZE:
+            LEADERBOARD_CACHE.popitem(last=False)
 
+    with METRICS.span('discord.upload'):
+        for filename, image in images:
+            await ctx.channel.send(file=discord.File(io.BytesIO(image), filename))
 
-async def pie_chart_scoreboard(ctx, scoreboard: Dict[str, Tuple[int, int]]) -> None:
+
+async def render_leaderboard(args: Tuple[str, ...]) -> Optional[List[Tuple[str, bytes]]]:
     """
-    This is another version of the barchart scoreboard below this, however this one is concerned with the
-    percentage ratios of everyone's participation in the server, not the raw numbers. So it will show us relatively
-    who is the most active among everyone in a more direct manner.
+    Works out which charts a leaderboard query asks for and renders them from the current scoreboard
 
     Parameters:
-        ctx - The context from which this command was send
-        scoreboard - A dictionary linking all peoples names to a tuples of (# Quotes, # Memes) counters
+        args - The arguments given to the leaderboard command
 
     Returns:
-        Nothing
+        images - The (filename, PNG bytes) of every chart to send, or None if the query is malformed
     """
 
-    async def send_pie_chart(authors: List[str], contributions: List[int], content_type: str) -> None:
-        """
-        A quick async function that takes in a list of authors and their corresponding counts for quotes/memes
-        and will create a nice and pretty pie chart from this and send it in the chat for fun. Most of the styling for
-        this graph was taken form the website below.
+    scoreboard_info = get_statistics_dict()  # Get the scoreboard in the form Name -> (# Quotes, # Memes)
 
-        Parameters:
-            authors - A list of strings of all of the authors in the server
-            contributions - A list of numbers of their total contribution count to the server
-            content_type - The type of content this is counting so either memes or quotes
+    if len(args) == 0:
+        return await bar_chart_scoreboard(scoreboard_info)
 
-        Returns:
-            Nothing
+    elif args[0] == 'pie':
+        return await pie_chart_scoreboard(scoreboard_info)
 
-        References:
-            https://medium.com/@kvnamipara/a-better-visualisation-of-pie-charts-by-matplotlib-935b7667d77f
-        """
+    elif len(args) == 1 and args[0].isdigit():
+        return await bar_chart_scoreboard(scoreboard_info, top_n_authors=int(args[0]))
 
-        slice_colors = ['#7fe5f0', '#407294', '#ff7373', '#8a2be2', '#7fffd4', '#ffd700', '#5ac18e',
-                        '#947fff', '#f0f0f0', '#f190c1', '#f9ae54', '#bb6c5d', '#924431', '#2e465e',
-                        '#fadb6a', '#4dacb4', '#6b724', '#d28a2d']
+    elif all([name.title() in scoreboard_info for name in args]):
+        return await bar_chart_scoreboard(scoreboard_info, requested_authors=args)
 
-        fig1, ax1 = plt.subplots()
-        ax1.pie(contributions, colors=slice_colors, labels=authors, autopct='%1.1f%%', startangle=90,
-                pctdistance=0.85, labeldistance=1.05, textprops={'fontsize': 19})
-        centre_circle = plt.Circle((0, 0), 0.70, fc='white')
+    return None
 
-        plt.title(f'Total {content_type} Contributions', pad=20, fontweight='bold', fontsize=30)
 
-        fig = plt.gcf()
-        fig.gca().add_artist(centre_circle)
-        fig.set_size_inches(18., 14.)
-        ax1.axis('equal')
-        plt.tight_layout()
+async def pie_chart_scoreboard(scoreboard: Dict[str, Tuple[int, int]]) -> List[Tuple[str, bytes]]:
+    """
+    This is another version of the barchart scoreboard below this, however this one is concerned with the
+    percentage ratios of everyone's participation in the server, not the raw numbers. So it will show us relatively
+    who is the most active among everyone in a more direct manner.
+
+    Parameters:
+        scoreboard - A dictionary linking all peoples names to a tuples of (# Quotes, # Memes) counters
 
-        plt.savefig('quote_percentages.jpg')
-        await ctx.channel.send(file=discord.File('quote_percentages.jpg'))
-        os.remove('quote_percentages.jpg')
+    Returns:
+        images - The (filename, PNG bytes) of the quote pie chart and the meme pie chart
+    """
 
     total_quotes = sum([quotes for quotes, _ in scoreboard.values()])
     total_memes = sum([memes for _, memes in scoreboard.values()])
@@ -158,25 +241,30 @@ async def pie_chart_scoreboard(ctx, scoreboard: Dict[str, Tuple[int, int]]) -> N
     num_memes.append(misc_memes)
     meme_authors.append('Misc.')
 
-    await send_pie_chart(quote_authors, num_quotes, 'Quote')
-    await send_pie_chart(meme_authors, num_memes, 'Meme')
+    images = list()
 
+    for authors, contributions, content_type in [(quote_authors, num_quotes, 'Quote'),
+                                                 (meme_authors, num_memes, 'Meme')]:
+        image = await render_chart(render_pie_chart, authors, contributions, content_type)
+        images.append((f'{content_type.lower()}_percentages.png', image))
 
-async def send_leaderboard_image(ctx, scoreboard: Dict[str, Tuple[int, int]], requested_authors=None,
-                                 top_n_authors=0) -> None:
+    return images
+
+
+async def bar_chart_scoreboard(scoreboard: Dict[str, Tuple[int, int]], requested_authors=None,
+                               top_n_authors=0) -> List[Tuple[str, bytes]]:
     """
-    A relatively long function that parses the raw scoreboard data into a matplotlib graph and then sends that
-    graph in the querying channel. This version is a bar graph and is relatively modular in that it can send
+    A relatively long function that parses the raw scoreboard data into a matplotlib graph to be sent in the
+    querying channel. This version is a bar graph and is relatively modular in that it can send
     only a few people or everyone or only the top n people etc.
 
     Parameters:
-        ctx - The context from which this command was send
         scoreboard - A dictionary linking all peoples names to a tuples of (# Quotes, # Memes) counters
         requested_authors - A list of requested authors, if blank then just get everyone
         top_n_authors - An int representing we want the top n authors, if none then just get everyone
 
     Returns:
-        Nothing
+        images - The (filename, PNG bytes) of the bar graph
     """
 
     if top_n_authors:
@@ -193,37 +281,5 @@ async def send_leaderboard_image(ctx, scoreboard: Dict[str, Tuple[int, int]], re
             memes.append(meme)
             quotes.append(quote)
 
-    meme_column = np.arange(len(authors))
-    quotes_column = meme_column + .25
-
-    fig, ax = plt.subplots()
-
-    ax.barh(meme_column, memes, color='#1f85de', height=.25, edgecolor='white', label='Memes')
-    ax.barh(quotes_column, quotes, color='#f33b2f', height=.25, edgecolor='white', label='Quotes')
-
-    plt.xlabel('Count', labelpad=15, fontweight='bold', fontsize=20)
-    plt.ylabel('People', labelpad=15, fontweight='bold', fontsize=20)
-
-    plt.xticks(fontsize=15)
-    plt.yticks(meme_column + .125, authors, fontsize=15)
-    plt.title('Bruh Bot Scoreboard', pad=15, fontweight='bold', fontsize=30)
-
-    ax.spines['top'].set_visible(False)
-    ax.spines['right'].set_visible(False)
-    ax.spines['bottom'].set_visible(False)
-    ax.spines['left'].set_color('#DDDDDD')
-
-    ax.tick_params(bottom=False, left=False)
-
-    ax.set_axisbelow(True)
-    ax.xaxis.grid(True, color='#EEEEEE')
-    ax.yaxis.grid(False)
-
-    fig.set_size_inches(18., 14.)
-    fig.tight_layout()
-
-    plt.legend()
-    plt.savefig('scoreboard.jpg')
-
-    await ctx.channel.send(file=discord.File('scoreboard.jpg'))
-    os.remove('scoreboard.jpg')
+    image = await render_chart(render_scoreboard, authors, quotes, memes)
+    return [('scoreboard.png', image)]
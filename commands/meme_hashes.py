@@ -0,0 +1,191 @@
+import hashlib
+import io
+import json
+import threading
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Optional, Set, Tuple
+
+from commands.meme_index import MemeInfo
+from commands.persistence import DebouncedSave, save_json
+
+
+Digest = Tuple[str, Optional[int]]  # The (SHA-256, perceptual hash) of a meme, the latter None if it is not an image
+
+
+def perceptual_hash(data: bytes) -> Optional[int]:
+    """
+    Computes a 64 bit difference hash of an image, which stays the same when an image is recompressed or resized, so
+    reposts of the same meme end up with hashes only a few bits apart. Anything that is not a still image gets None.
+    Images with little detail at 9x8, like text on a plain background, all hash to nearly the same few bits, so the
+    hash is only a hint that two memes might be the same and never proof
+
+    Parameters:
+        data - The raw bytes of the file to hash
+
+    Returns:
+        hash - The perceptual hash as an int, or None if the file could not be read as an image
+    """
+
+    try:
+        from PIL import Image
+        image = Image.open(io.BytesIO(data)).convert('L').resize((9, 8))
+    except Exception:  # Videos, corrupt images or Pillow not being installed all mean there is no perceptual hash
+        return None
+
+    pixels = list(image.getdata())
+    bits = [pixels[row * 9 + col] < pixels[row * 9 + col + 1] for row in range(8) for col in range(8)]
+
+    return sum(1 << i for i, bit in enumerate(bits) if bit)
+
+
+def digest(data: bytes) -> Digest:
+    """Gets both the exact and the perceptual hash of a file's contents"""
+    return hashlib.sha256(data).hexdigest(), perceptual_hash(data)
+
+
+def digest_file(path: str) -> Digest:
+    """Gets both the exact and the perceptual hash of a file on disk"""
+    return digest(Path(path).read_bytes())
+
+
+class MemeHashes:
+    """
+    A content addressed index of every meme in the memes folder, so that a meme that was already added under any
+    author can be recognised when it is reposted. Every meme is stored under its 'author/filename' key with its size,
+    modification time, SHA-256 and perceptual hash, and we keep a reverse index of SHA-256 -> keys for exact matches.
+    Only exact matches count as duplicates, memes whose perceptual hashes are close are merely reported as lookalikes.
+    The index is saved to a JSON file, so after the first build only memes whose size or mtime changed are rehashed.
+    Adding and removing single memes only saves it a little while later, so a batch of attachments is one write.
+    """
+
+    def __init__(self, state_file: str, memes_path: str, max_distance: int = 6, min_detail: int = 12,
+                 save_delay: float = 10.) -> None:
+
+        self.state_file = Path(state_file)
+        self.memes_path = Path(memes_path)
+        self.max_distance = max_distance
+        self.min_detail = min_detail  # How many bits of a perceptual hash must differ from a flat image's all zeros
+        self._entries: Dict[str, Tuple[int, int, str, Optional[int]]] = dict()
+        self._by_sha: Dict[str, Set[str]] = defaultdict(set)
+        self._lock = threading.Lock()
+        self._save_soon = DebouncedSave(self.save, save_delay)
+
+        if self.state_file.exists():
+            with open(self.state_file, 'r') as state:
+                for key, (size, mtime, sha, phash) in json.load(state).items():
+                    self._store(key, (size, mtime), (sha, phash))
+
+    def _store(self, key: str, info: MemeInfo, meme_digest: Digest) -> None:
+        """Records the hashes of a meme, replacing whatever we had for that key before"""
+
+        self._discard(key)
+        self._entries[key] = (*info, *meme_digest)
+        self._by_sha[meme_digest[0]].add(key)
+
+    def _discard(self, key: str) -> None:
+        """Forgets the hashes of a meme if we had them"""
+
+        entry = self._entries.pop(key, None)
+
+        if entry is not None:
+            self._by_sha[entry[2]].discard(key)
+            if not self._by_sha[entry[2]]:
+                del self._by_sha[entry[2]]
+
+    def sync(self, memes: Dict[str, Dict[str, MemeInfo]]) -> None:
+        """
+        Brings the index up to date with a listing of the memes folder, hashing only the memes that are new or whose
+        size or modification time changed, and then saves it. This reads files so it is meant to be run in an executor
+
+        Parameters:
+            memes - The listing of the memes folder as author -> filename -> (size, mtime)
+
+        Returns:
+            Nothing
+        """
+
+        listing = {f'{author}/{name}': info for author, files in memes.items() for name, info in files.items()}
+
+        with self._lock:
+            stale = [key for key, entry in self._entries.items() if listing.get(key) != entry[:2]]
+            for key in stale:
+                self._discard(key)
+            missing = [key for key in listing if key not in self._entries]
+
+        for key in missing:
+            try:
+                meme_digest = digest((self.memes_path / key).read_bytes())
+            except OSError:  # The meme was removed while we were hashing
+                continue
+            with self._lock:
+                self._store(key, listing[key], meme_digest)
+
+        self.save()
+
+    def duplicate_of(self, meme_digest: Digest) -> Optional[str]:
+        """
+        Finds a meme already in the index that is byte for byte identical to a meme with the given hashes
+
+        Parameters:
+            meme_digest - The (SHA-256, perceptual hash) of the meme we want to add
+
+        Returns:
+            key - The 'author/filename' of the existing meme, or None if this meme is new
+        """
+
+        with self._lock:
+            keys = self._by_sha.get(meme_digest[0])
+            return min(keys) if keys else None
+
+    def detailed(self, phash: Optional[int]) -> bool:
+        """Whether a perceptual hash has enough detail to compare, rather than being a nearly flat or plain image"""
+        return phash is not None and self.min_detail <= bin(phash).count('1') <= 64 - self.min_detail
+
+    def lookalike_of(self, meme_digest: Digest) -> Optional[str]:
+        """
+        Finds a meme already in the index that looks nearly identical to a meme with the given hashes, which might be a
+        repost of it that was recompressed or resized. Images without enough detail to compare are never matched
+
+        Parameters:
+            meme_digest - The (SHA-256, perceptual hash) of the meme we want to add
+
+        Returns:
+            key - The 'author/filename' of the closest lookalike, or None if nothing looks like this meme
+        """
+
+        phash = meme_digest[1]
+
+        if not self.detailed(phash):
+            return None
+
+        with self._lock:
+            distances = [(bin(phash ^ other).count('1'), key) for key, (_, _, _, other) in self._entries.items()
+                         if self.detailed(other)]
+
+        distance, key = min(distances, default=(None, None))
+        return key if distance is not None and distance <= self.max_distance else None
+
+    def add(self, author: str, filename: str, info: MemeInfo, meme_digest: Digest) -> None:
+        """Records the hashes of a meme that was just saved and schedules the index to be saved"""
+
+        with self._lock:
+            self._store(f'{author}/{filename}', info, meme_digest)
+
+        self._save_soon()
+
+    def remove(self, author: str, filename: str) -> None:
+        """Forgets the hashes of a meme that was just deleted and schedules the index to be saved"""
+
+        with self._lock:
+            self._discard(f'{author}/{filename}')
+
+        self._save_soon()
+
+    def save(self) -> None:
+        """Atomically writes the index to its JSON file"""
+
+        with self._lock:
+            entries = dict(self._entries)
+
+        save_json(self.state_file, entries)
@@ -0,0 +1,207 @@
+import os
+import random
+import time
+from bisect import bisect_right
+from itertools import accumulate
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:  # Without inotify we fall back to checking the directory modification times
+    INotify = None
+
+
+MemeInfo = Tuple[int, int]  # The (size in bytes, modification time in ns) of a meme file
+
+
+class MemeIndex:
+    """
+    An in-memory listing of the memes folder, kept as author -> filename -> (size, mtime), so that meme commands do
+    not have to list the folder on the SD card every time they run. The folder is scanned once when the index is
+    created and then kept fresh incrementally. With inotify available only the folders we get events for are
+    rescanned, otherwise each refresh stats the memes folder and every author's folder and only rescans the ones whose
+    modification time changed. Refreshes are throttled so a burst of commands only checks the disk once.
+
+    We also keep a cumulative count of memes per author, rebuilt only after the listing changes, so an author can be
+    picked with probability proportional to how many memes they have with a single binary search.
+    """
+
+    def __init__(self, memes_path: str, refresh_interval: float = 1.) -> None:
+
+        self.memes_path = Path(memes_path)
+        self.refresh_interval = refresh_interval
+        self._memes: Dict[str, Dict[str, MemeInfo]] = dict()
+        self._folder_mtimes: Dict[str, int] = dict()
+        self._root_mtime = None
+        self._last_refresh = 0.
+        self._inotify = None
+        self._watches: Dict[int, str] = dict()
+        self._cumulative: Optional[Tuple[List[str], List[int]]] = None
+        self.version = 0  # Goes up whenever the listing changes, so anything derived from it knows when it is stale
+
+        if INotify is not None:
+            try:
+                self._inotify = INotify()
+            except OSError:  # Out of inotify instances, or not supported here, so poll instead
+                self._inotify = None
+
+        self._scan_root()
+
+    def _changed(self) -> None:
+        """Notes that the listing changed, dropping the cumulative counts built from the old one"""
+        self._cumulative = None
+        self.version += 1
+
+    def _watch(self, folder: Path, author: str) -> None:
+        """Starts watching a folder for changes if inotify is available"""
+
+        if self._inotify is not None:
+            mask = flags.CREATE | flags.DELETE | flags.MOVED_FROM | flags.MOVED_TO | flags.CLOSE_WRITE
+            try:
+                self._watches[self._inotify.add_watch(str(folder), mask)] = author
+            except OSError:
+                pass
+
+    def _scan_author(self, author: str) -> None:
+        """Relists a single author's folder, or forgets them if their folder is gone"""
+
+        folder = self.memes_path / author
+
+        try:
+            self._folder_mtimes[author] = folder.stat().st_mtime_ns
+            entries = list(os.scandir(folder))
+        except (FileNotFoundError, NotADirectoryError):
+            self._memes.pop(author, None)
+            self._folder_mtimes.pop(author, None)
+            self._changed()
+            return
+
+        if author not in self._memes:
+            self._watch(folder, author)
+
+        self._memes[author] = {entry.name: (entry.stat().st_size, entry.stat().st_mtime_ns)
+                               for entry in entries if entry.is_file()}  # DirEntry caches its stat result
+        self._changed()
+
+    def _scan_root(self) -> None:
+        """Lists the memes folder for new or deleted authors, rescanning only the authors we did not know about"""
+
+        if not self.memes_path.exists():
+            if self._memes:
+                self._memes.clear()
+                self._changed()
+            return
+
+        if self._root_mtime is None:
+            self._watch(self.memes_path, '')
+
+        self._root_mtime = self.memes_path.stat().st_mtime_ns
+        authors = {entry.name for entry in os.scandir(self.memes_path) if entry.is_dir()}
+
+        for author in set(self._memes) - authors:
+            self._memes.pop(author, None)
+            self._folder_mtimes.pop(author, None)
+            self._changed()
+
+        for author in authors - set(self._memes):
+            self._scan_author(author)
+
+    def refresh(self, force: bool = False) -> None:
+        """Brings the index up to date with any changes made to the memes folder since the last refresh"""
+
+        if not force and time.monotonic() - self._last_refresh < self.refresh_interval:
+            return
+
+        self._last_refresh = time.monotonic()
+
+        if self._inotify is not None:
+
+            changed = {self._watches.get(event.wd) for event in self._inotify.read(timeout=0)}
+
+            if '' in changed:
+                self._scan_root()
+
+            for author in changed - {'', None}:
+                self._scan_author(author)
+
+            return
+
+        if not self.memes_path.exists() or self.memes_path.stat().st_mtime_ns != self._root_mtime:
+            self._scan_root()
+
+        for author, mtime in list(self._folder_mtimes.items()):
+            try:
+                if (self.memes_path / author).stat().st_mtime_ns != mtime:
+                    self._scan_author(author)
+            except FileNotFoundError:
+                self._scan_author(author)
+
+    def authors(self) -> List[str]:
+        """Gets the name of every author's folder"""
+        self.refresh()
+        return list(self._memes)
+
+    def has_author(self, author: str) -> bool:
+        """Checks if an author has a folder in the memes folder"""
+        self.refresh()
+        return author in self._memes
+
+    def memes_of(self, author: str) -> Dict[str, MemeInfo]:
+        """Gets the filename -> (size, mtime) of every meme in an author's folder, empty if they have no folder"""
+        self.refresh()
+        return self._memes.get(author, dict())
+
+    def has(self, author: str, filename: str) -> bool:
+        """Checks if an author has a meme with the given filename"""
+        return filename in self.memes_of(author)
+
+    def counts(self) -> Dict[str, int]:
+        """Gets the number of memes in every author's folder"""
+        self.refresh()
+        return {author: len(memes) for author, memes in self._memes.items()}
+
+    def weighted_author(self, random_gen: random.Random) -> Optional[str]:
+        """
+        Picks an author with probability proportional to their number of memes, so that drawing one of their memes
+        afterwards gives every meme in the database the same chance of being picked
+
+        Parameters:
+            random_gen - The random number generator to use
+
+        Returns:
+            author - The picked author, or None if there are no memes at all
+        """
+
+        self.refresh()
+
+        if self._cumulative is None:
+            authors = [author for author, memes in self._memes.items() if memes]
+            self._cumulative = authors, list(accumulate(len(self._memes[author]) for author in authors))
+
+        authors, totals = self._cumulative
+
+        return authors[bisect_right(totals, random_gen.randrange(totals[-1]))] if totals else None
+
+    def add(self, author: str, filename: str) -> None:
+        """Records a meme we just saved, creating the author's entry if this is their first one"""
+
+        path = self.memes_path / author / filename
+        stat = path.stat()
+
+        if author not in self._memes:
+            self._watch(path.parent, author)
+            self._memes[author] = dict()
+
+        self._memes[author][filename] = (stat.st_size, stat.st_mtime_ns)
+        self._folder_mtimes[author] = path.parent.stat().st_mtime_ns
+        self._changed()
+
+    def remove(self, author: str, filename: str) -> None:
+        """Records a meme we just deleted"""
+
+        self._memes.get(author, dict()).pop(filename, None)
+        self._changed()
+
+        if (self.memes_path / author).exists():
+            self._folder_mtimes[author] = (self.memes_path / author).stat().st_mtime_ns
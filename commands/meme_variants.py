@@ -0,0 +1,144 @@
+import glob
+import io
+from pathlib import Path
+from typing import Dict, Optional
+
+from commands.meme_index import MemeInfo
+from commands.persistence import atomic_write
+
+
+UPLOAD_LIMIT = 8 * 1024 * 1024  # The largest file Discord lets a bot upload to a server without boosts
+IMAGE_SUFFIXES = {'.jpg', '.jpeg', '.png', '.webp', '.bmp'}  # Gifs are left alone so they keep their animation
+
+
+class MemeVariants:
+    """
+    A cache of recompressed, dimension capped copies of the memes, so that sending a meme uploads a few hundred
+    kilobytes instead of whatever the original happened to be. Each variant is named after the size and modification
+    time of its original, so editing or replacing a meme automatically makes a new variant. When recompressing would
+    not make a meme any smaller we leave an empty marker file instead, so we remember to just send the original.
+    """
+
+    def __init__(self, cache_path: str, memes_path: str, max_dimension: int = 1920,
+                 max_bytes: int = UPLOAD_LIMIT) -> None:
+
+        self.cache_path = Path(cache_path)
+        self.memes_path = Path(memes_path)
+        self.max_dimension = max_dimension
+        self.max_bytes = max_bytes
+
+    def _variant(self, author: str, filename: str, info: MemeInfo) -> Path:
+        """Gets the path a meme's variant is cached at for the given version of the original"""
+        return self.cache_path / author / f'{filename}.{info[0]}-{info[1]}.jpg'
+
+    def cached(self, author: str, filename: str, info: MemeInfo) -> Optional[Path]:
+        """
+        Gets the file we should send for a meme if we already know it, without touching the original
+
+        Parameters:
+            author - The author whose folder the meme is in
+            filename - The filename of the meme
+            info - The (size, mtime) of the meme, from the meme index
+
+        Returns:
+            path - The variant if there is one, the original if there is no point in one, or None if we do not know yet
+        """
+
+        variant = self._variant(author, filename, info)
+
+        if Path(filename).suffix.lower() not in IMAGE_SUFFIXES:
+            return self.memes_path / author / filename
+
+        try:
+            return variant if variant.stat().st_size else self.memes_path / author / filename
+        except FileNotFoundError:
+            return None
+
+    def prepare(self, author: str, filename: str, info: MemeInfo) -> Path:
+        """
+        Gets the file we should send for a meme, making its variant first if we have not yet. This decodes and
+        encodes images so it is meant to be run in an executor
+
+        Parameters:
+            author - The author whose folder the meme is in
+            filename - The filename of the meme
+            info - The (size, mtime) of the meme, from the meme index
+
+        Returns:
+            path - The path of the file to send
+        """
+
+        path = self.cached(author, filename, info)
+
+        if path is not None:
+            return path
+
+        from PIL import Image, ImageOps
+
+        original = self.memes_path / author / filename
+        variant = self._variant(author, filename, info)
+        variant.parent.mkdir(parents=True, exist_ok=True)
+
+        # Throw away the variants made from older versions of this meme, but never the one another thread might have
+        # just made for this version
+        self._discard(author, filename, keep=variant)
+
+        try:
+            with Image.open(original) as image:
+
+                # Phone photos are stored sideways with a tag saying which way is up, which JPEG encoding would drop
+                image = ImageOps.exif_transpose(image)
+                image.thumbnail((self.max_dimension, self.max_dimension))
+
+                # Flatten transparent memes onto white rather than letting JPEG turn the transparency black
+                if image.mode in ('RGBA', 'LA', 'P'):
+                    image = image.convert('RGBA')
+                    background = Image.new('RGB', image.size, (255, 255, 255))
+                    background.paste(image, mask=image.getchannel('A'))
+                    image = background
+
+                data = self._encode(image.convert('RGB'))
+        except Exception:  # Pillow cannot read it so the original is all we can send
+            data = None
+
+        smaller = data is not None and len(data) < info[0]
+
+        with atomic_write(variant, 'wb') as temp:
+            if smaller:
+                temp.write(data)
+
+        return variant if smaller else original
+
+    def _discard(self, author: str, filename: str, keep: Path = None) -> None:
+        """Deletes every variant of a meme except the one to keep, ignoring any that another thread deleted first"""
+
+        for old in (self.cache_path / author).glob(f'{glob.escape(filename)}.*.jpg'):
+            if old != keep:
+                try:
+                    old.unlink()
+                except FileNotFoundError:
+                    pass
+
+    def remove(self, author: str, filename: str) -> None:
+        """Deletes the variants of a meme that was just removed"""
+        self._discard(author, filename)
+
+    def _encode(self, image) -> bytes:
+        """Encodes an image as a JPEG, lowering the quality and then the resolution until it fits the upload limit"""
+
+        while True:
+
+            for quality in (85, 70, 55, 40):
+                buffer = io.BytesIO()
+                image.save(buffer, 'JPEG', quality=quality, optimize=True)
+                if buffer.tell() <= self.max_bytes:
+                    return buffer.getvalue()
+
+            image = image.resize((max(1, image.width // 2), max(1, image.height // 2)))
+
+    def prewarm(self, memes: Dict[str, Dict[str, MemeInfo]]) -> None:
+        """Makes the variant of every meme that does not have one yet, meant to be run in the background"""
+
+        for author, files in memes.items():
+            for filename, info in files.items():
+                self.prepare(author, filename, info)
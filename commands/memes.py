@@ -1,12 +1,100 @@
 import discord
 
+import asyncio
+import os
 import random
+import tempfile
+import traceback
 from pathlib import Path
+from typing import Tuple
 
 from commands import *
+from commands.meme_hashes import MemeHashes, digest_file
+from commands.metrics import METRICS
+from commands.output import send_paginated
+from commands.meme_index import MemeIndex
+from commands.meme_variants import UPLOAD_LIMIT, MemeVariants
+from commands.rotation import ShuffleBag
+from commands.scoreboard import SCOREBOARD
 
 
-SEEN_MEMES = set()  # A global variable that keeps track of all 'stale' memes
+MEMES = MemeIndex(MEMES_PATH)  # The listing of everyone's memes, scanned once and then kept fresh incrementally
+
+# The content hashes of everyone's memes, so the same meme cannot be added twice even under different authors
+MEME_HASHES = MemeHashes(str(Path(STATE_PATH, 'meme-hashes.json')), MEMES_PATH)
+
+# The recompressed copies of the memes that we send instead of the originals, if they are turned on
+VARIANTS = MemeVariants(VARIANTS_PATH, MEMES_PATH) if VARIANTS_PATH else None
+
+DOWNLOADS = asyncio.Semaphore(4)  # Limits how many attachments are downloaded at once over the Pi's Wi-Fi
+
+# The permissions saving a file normally gives it, since the temporary files the downloads go to are owner only
+UMASK = os.umask(0)
+os.umask(UMASK)
+FILE_MODE = 0o666 & ~UMASK
+
+# The no-repeat rotation of everyone's memes, so we cannot re-see a meme until we have gone through all of them
+ROTATION = ShuffleBag(str(Path(STATE_PATH, 'meme-rotation.json')))
+
+
+HASH_SYNC = None  # The background update of the meme content hashes, started whenever we connect
+
+
+async def sync_hashes() -> None:
+    """Brings the meme content hashes up to date in an executor, only hashing the memes that were added or changed
+    since the hashes were last saved"""
+
+    listing = {author: dict(MEMES.memes_of(author)) for author in MEMES.authors()}
+    await asyncio.get_event_loop().run_in_executor(None, MEME_HASHES.sync, listing)
+
+
+@BOT.listen('on_ready')
+async def hash_memes() -> None:
+    """Starts updating the meme content hashes whenever the bot connects, unless an update is still running"""
+
+    global HASH_SYNC
+
+    if HASH_SYNC is None or HASH_SYNC.done():
+        HASH_SYNC = asyncio.ensure_future(sync_hashes())
+
+
+@BOT.listen('on_ready')
+async def prewarm_memes() -> None:
+    """Makes the recompressed copy of every meme that does not have one yet in the background, if they are turned on"""
+
+    if VARIANTS is not None:
+        listing = {author: dict(MEMES.memes_of(author)) for author in MEMES.authors()}
+        await asyncio.get_event_loop().run_in_executor(None, VARIANTS.prewarm, listing)
+
+
+async def send_meme(ctx, author: str, filename: str) -> None:
+    """
+    Sends a meme in the chat, using its recompressed copy when those are turned on and making that copy first if it
+    does not exist yet. Memes that are too large for Discord get an apology instead of a failed upload
+
+    Parameters:
+        ctx - The context from which this command was send
+        author - The author whose folder the meme is in
+        filename - The filename of the meme to send
+
+    Returns:
+        Nothing
+    """
+
+    path = Path(MEMES_PATH, author, filename)
+
+    if VARIANTS is not None:
+        info = MEMES.memes_of(author)[filename]
+        with METRICS.span('memes.variant'):
+            path = VARIANTS.cached(author, filename, info) or \
+                await asyncio.get_event_loop().run_in_executor(None, VARIANTS.prepare, author, filename, info)
+
+    if UPLOAD_LIMIT < path.stat().st_size:
+        await ctx.channel.send(f'{filename} is too large for Discord to send, sorry!')
+        return
+
+    with METRICS.span('discord.upload'):
+        await ctx.channel.send(file=discord.File(str(path), filename=f'{Path(filename).stem}{path.suffix}'))
 
 
 @BOT.command(name='add-meme', brief='Adds a new meme to the database associated with a specific person')
@@ -30,20 +118,83 @@ async def save_meme(ctx, author: str, *filenames) -> None:
 
     author = author.lower() # Lowercase the input author for homogeneity
 
-    if not Path(MEMES_PATH, author).exists():
-        Path(MEMES_PATH, author).mkdir()
+    if not MEMES.has_author(author):
+        Path(MEMES_PATH, author).mkdir(exist_ok=True)
 
-    for attachment, file in zip(ctx.message.attachments, filenames):
+    results = await asyncio.gather(*[download_meme(author, attachment, file)
+                                     for attachment, file in zip(ctx.message.attachments, filenames)])
+    saved = sum(1 for success, _ in results if success)
 
-        filename = f'{file.lower()}{Path(attachment.filename).suffix}'
-        present_files = [name.stem for name in Path(MEMES_PATH, author).iterdir()]
+    await ctx.channel.send(f'Saved {saved} of {len(results)} memes to the database for future usage.\n' +
+                           '\n'.join(message for _, message in results))
 
-        if filename not in present_files:
-            await attachment.save(str(Path(MEMES_PATH, author, filename)))
-        else:
-            await ctx.channel.send(f'Filename, {filename}, for user {author} is already taken, try again!')
 
-    await ctx.channel.send('Meme has been saved to the database for future usage.')
+async def download_meme(author: str, attachment, file: str) -> Tuple[bool, str]:
+    """
+    Downloads a single attachment into an author's meme folder. At most a few downloads run at once, each one is
+    written to a temporary file first and only renamed into the author's folder once we know it is not a duplicate,
+    so a half downloaded meme never shows up in the database
+
+    Parameters:
+        author - The author to save the meme under
+        attachment - The discord attachment to download
+        file - The filename, without an extension, to save the meme as
+
+    Returns:
+        result - A tuple of whether the meme was saved and a line describing what happened to it
+    """
+
+    filename = f'{file.lower()}{Path(attachment.filename).suffix}'
+
+    def filename_taken() -> bool:
+        return file.lower() in {Path(name).stem for name in MEMES.memes_of(author)}
+
+    if filename_taken():
+        return False, f'Filename, {filename}, for user {author} is already taken, try again!'
+
+    async with DOWNLOADS:
+
+        # Download next to the author folders so the final rename never has to cross file systems
+        handle, temp_file = tempfile.mkstemp(dir=MEMES_PATH, prefix='.download-')
+        os.close(handle)
+
+        try:
+            await attachment.save(temp_file)
+            meme_digest = await asyncio.get_event_loop().run_in_executor(None, digest_file, temp_file)
+
+            # Until the hashes are up to date a repost of a meme that has not been hashed yet would slip through
+            if HASH_SYNC is not None and not HASH_SYNC.done():
+                await asyncio.wait({HASH_SYNC})
+
+            duplicate = MEME_HASHES.duplicate_of(meme_digest)
+            lookalike = MEME_HASHES.lookalike_of(meme_digest) if duplicate is None else None
+
+            if duplicate is not None:
+                return False, f'{filename} is already in the database as {duplicate}, no need to add it again.'
+            elif filename_taken():
+                return False, f'Filename, {filename}, for user {author} is already taken, try again!'
+
+            os.chmod(temp_file, FILE_MODE)
+            os.replace(temp_file, Path(MEMES_PATH, author, filename))
+
+        except Exception:  # One failed download only loses that meme, the others and the summary still go through
+            print(f'Could not save {filename} for {author}:')
+            traceback.print_exc()
+            return False, f'Could not download {filename} for {author}, try again!'
+
+        finally:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+
+    MEMES.add(author, filename)
+    MEME_HASHES.add(author, filename, MEMES.memes_of(author)[filename], meme_digest)
+    ROTATION.insert([author], filename)
+    SCOREBOARD.add_meme(author)
+
+    if lookalike is not None:
+        return True, f'Saved {filename} for {author}, though it looks a lot like {lookalike}.'
+
+    return True, f'Saved {filename} for {author}.'
 
 
 @BOT.command(name='delete-meme', brief='Removes a mistyped or mis-associated meme from the database')
@@ -70,7 +221,7 @@ async def remove_meme(ctx, author=None, filename=None) -> None:
         await ctx.channel.send(f"Nice try, {ctx.message.author.mention}, but this is only for emergencies")
         return
 
-    elif not Path(MEMES_PATH, author).exists():
+    elif not MEMES.has_author(author):
         await ctx.channel.send(f"{author} doesn't exist in the database, so we cannot remove a meme for them.")
         return
 
@@ -78,11 +229,16 @@ async def remove_meme(ctx, author=None, filename=None) -> None:
         await ctx.channel.send("Query cannot be completed because you did not give enough information.")
         return
 
-    for meme_file in Path(MEMES_PATH, author).iterdir():
+    for meme_name in MEMES.memes_of(author):
 
-        if meme_file.stem == filename:
-            meme_file.unlink()
-            await ctx.channel.send(f"Meme {meme_file.name} was remove from {author}'s meme folder successfully")
+        if Path(meme_name).stem == filename:
+            Path(MEMES_PATH, author, meme_name).unlink()
+            MEMES.remove(author, meme_name)
+            MEME_HASHES.remove(author, meme_name)
+            if VARIANTS is not None:
+                VARIANTS.remove(author, meme_name)
+            SCOREBOARD.remove_meme(author)
+            await ctx.channel.send(f"Meme {meme_name} was remove from {author}'s meme folder successfully")
             return
 
     await ctx.channel.send(f"Meme was not present in {author}'s directory, are you sure this is the right name?")
@@ -104,40 +260,46 @@ async def get_meme(ctx, author='random', requested_meme=None) -> None:
         Nothing
     """
 
-    global SEEN_MEMES        # Make sure we can edit the global set if applicable
     author = author.lower()  # Make sure the author's name is lowercase for homogeneity
 
-    if not Path(MEMES_PATH, author).exists() and author != 'random':
+    if not MEMES.has_author(author) and author != 'random':
         await ctx.channel.send(f'{author} has no memes associated with them. Add some!')
         return
 
     elif requested_meme is not None:
 
-        if not Path(MEMES_PATH, author, requested_meme).exists():
+        if not MEMES.has(author, requested_meme):
             await ctx.channel.send(f"This meme does not exist in the database, are you sure you're using this right?")
         elif author == 'random':
             await ctx.channel.send(f"Cannot request a specified meme for any author, that's illegal")
         else:
-            await ctx.channel.send(file=discord.File(str(Path(MEMES_PATH, author, requested_meme))))
+            await send_meme(ctx, author, requested_meme)
 
         return
 
     random_gen = random.SystemRandom()
 
-    if author == 'random':
-        author = random_gen.choice(list(Path(MEMES_PATH).iterdir()))
+    with METRICS.span('memes.pick'):
 
-    all_memes = {str(file) for file in Path(MEMES_PATH, author).iterdir()}
-    remove_duplicates = all_memes - SEEN_MEMES
+        if author == 'random' and MEME_SAMPLING == 'author':
+            author = random_gen.choice(MEMES.authors() or [None])
+        elif author == 'random':
+            author = MEMES.weighted_author(random_gen)
 
-    if not remove_duplicates:
-        SEEN_MEMES -= all_memes
-        meme = random_gen.choice(list(all_memes))
-    else:
-        meme = random_gen.choice(list(remove_duplicates))
+        if author is None:
+            meme = None
+        else:
+            meme = ROTATION.draw(author, lambda: list(MEMES.memes_of(author)), lambda name: MEMES.has(author, name))
+
+    if author is None:
+        await ctx.channel.send('There are no memes in the database yet. Add some!')
+        return
+
+    if meme is None:
+        await ctx.channel.send(f'{author} has no memes associated with them. Add some!')
+        return
 
-    SEEN_MEMES.add(str(meme))
-    await ctx.channel.send(file=discord.File(str(Path(MEMES_PATH, author, meme))))
+    await send_meme(ctx, author, meme)
 
 
 @BOT.command(name='list-memes', brief='Sends back a meme associated with a specified person or anyone if left unfilled')
@@ -148,9 +310,9 @@ async def list_memes(ctx, author=None):
         await ctx.channel.send(f"No author was specified to list the associated memes for!")
         return
 
-    elif not Path(MEMES_PATH, author).exists():
+    elif not MEMES.has_author(author):
         await ctx.channel.send(f"This author does not exist in the database, so they have no memes!")
         return
 
-    all_meme_names = '\n'.join(sorted([meme.name for meme in Path(MEMES_PATH, author).iterdir()]))
-    await ctx.channel.send(f"All memes associated with the author are as follows:\n{all_meme_names}")
+    await send_paginated(ctx.channel, sorted(MEMES.memes_of(author)),
+                         header='All memes associated with the author are as follows:')
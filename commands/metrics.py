@@ -0,0 +1,131 @@
+import math
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+from commands import METRICS_FILE
+from commands.persistence import DebouncedSave, atomic_write
+
+# The upper bounds, in seconds, of the latency histogram buckets, from a millisecond up to a slow chart render
+BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10., math.inf)
+
+
+class Histogram:
+    """A count of how many observations fell in each latency bucket, along with their total"""
+
+    def __init__(self) -> None:
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.total = 0.
+        self.fastest = math.inf
+        self.slowest = 0.
+
+    def observe(self, seconds: float) -> None:
+        self.buckets[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.fastest = min(self.fastest, seconds)
+        self.slowest = max(self.slowest, seconds)
+
+    def quantile(self, q: float) -> float:
+        """Estimates a quantile by interpolating inside the bucket it falls in, kept within the fastest and slowest
+        observations, so it is only as precise as the buckets are"""
+
+        rank, seen = q * self.count, 0
+
+        for i, count in enumerate(self.buckets):
+            if count and rank <= seen + count:
+                low = max(BUCKETS[i - 1] if i else 0., self.fastest)
+                high = min(BUCKETS[i], self.slowest)
+                return low + (high - low) * (rank - seen) / count
+            seen += count
+
+        return 0.
+
+
+class Metrics:
+    """
+    Latency histograms of named spans of work, such as a whole command or the chart rendering inside it, and counts
+    of how many times each command failed. Everything is kept in memory and can be summarised for the chat or written
+    out in the Prometheus text format for a node exporter's textfile collector to pick up.
+    """
+
+    def __init__(self, export_file: str = None, export_delay: float = 15.) -> None:
+
+        self.export_file = None if export_file is None else Path(export_file)
+        self.export_delay = export_delay
+        self._histograms: Dict[str, Histogram] = defaultdict(Histogram)
+        self._errors: Counter = Counter()
+        self._export_soon = DebouncedSave(self.export, export_delay)
+
+    def observe(self, name: str, seconds: float) -> None:
+        """Records how long one run of a span took"""
+        self._histograms[name].observe(seconds)
+        self.export_soon()
+
+    def error(self, name: str) -> None:
+        """Records that a command failed"""
+        self._errors[name] += 1
+        self.export_soon()
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        """Times the code inside the with block, including anything it awaits, and records it under the given name"""
+
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def summary(self) -> List[Tuple[str, int, float, float, float, int]]:
+        """Gets the name, count, mean, p50, p99 and error count of every span, the ones taking the most time first"""
+
+        spans = sorted(self._histograms.items(), key=lambda item: item[1].total, reverse=True)
+
+        return [(name, span.count, span.total / span.count, span.quantile(.5), span.quantile(.99),
+                 self._errors[name]) for name, span in spans]
+
+    def prometheus(self) -> str:
+        """Renders every histogram and error count in the Prometheus text exposition format"""
+
+        lines = ['# HELP bot_span_seconds How long each span of work took',
+                 '# TYPE bot_span_seconds histogram']
+
+        for name, span in sorted(self._histograms.items()):
+            cumulative = 0
+            for bound, count in zip(BUCKETS, span.buckets):
+                cumulative += count
+                lines.append(f'bot_span_seconds_bucket{{span="{name}",le="{"+Inf" if bound == math.inf else bound}"}} '
+                             f'{cumulative}')
+            lines.append(f'bot_span_seconds_sum{{span="{name}"}} {span.total}')
+            lines.append(f'bot_span_seconds_count{{span="{name}"}} {span.count}')
+
+        lines += ['# HELP bot_command_errors_total How many times each command failed',
+                  '# TYPE bot_command_errors_total counter']
+        lines += [f'bot_command_errors_total{{span="{name}"}} {count}' for name, count in sorted(self._errors.items())]
+
+        return '\n'.join(lines) + '\n'
+
+    def export_soon(self) -> None:
+        """Schedules the metrics to be exported shortly, so a burst of commands only costs a single write"""
+
+        if self.export_file is not None:
+            self._export_soon()
+
+    def export(self) -> None:
+        """Atomically writes the metrics to the export file"""
+
+        if self.export_file is None:
+            return
+
+        with atomic_write(self.export_file) as export:
+            export.write(self.prometheus())
+
+
+# Shared by every command, and exported to the metrics file if one is set
+METRICS = Metrics(METRICS_FILE)
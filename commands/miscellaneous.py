@@ -1,8 +1,58 @@
+import time
 from pathlib import Path
 
 import discord
 
 from commands import *
+from commands.metrics import METRICS
+from commands.output import send_paginated
+
+
+@BOT.before_invoke
+async def start_timing(ctx) -> None:
+    """Notes when every command starts running so we can time it"""
+    ctx.started = time.perf_counter()
+
+
+@BOT.after_invoke
+async def record_timing(ctx) -> None:
+    """Records how long every command took to run, and if it failed"""
+
+    name = f'command.{ctx.command.qualified_name}'
+    METRICS.observe(name, time.perf_counter() - ctx.started)
+
+    if ctx.command_failed:
+        METRICS.error(name)
+
+
+@BOT.command(name='stats-perf', brief='Sends how long each command and the work inside it has been taking')
+@lock_to_channel(CHANNEL_LOCK)
+async def performance_statistics(ctx) -> None:
+    """
+    Sends the number of runs, the mean and the estimated median and 99th percentile time of every command, and of
+    the timed pieces of work inside them like chart rendering or uploads, since the bot started. This is a privileged
+    action so only the admins can use it.
+
+    Parameters:
+        ctx - The context from which this command was send
+
+    Returns:
+        Nothing
+    """
+
+    if ctx.message.author.name != 'Bob the Great':
+        await ctx.channel.send(f"Nice try, {ctx.message.author.mention}, but this is only for emergencies")
+        return
+
+    summary = METRICS.summary()
+
+    if not summary:
+        await ctx.channel.send('Nothing has been timed yet.')
+        return
+
+    await send_paginated(ctx.channel, (f'{name}: {count} runs, mean {mean * 1000:.1f}ms, p50 {p50 * 1000:.1f}ms, '
+                                       f'p99 {p99 * 1000:.1f}ms' + (f', {errors} failed' if errors else '')
+                                       for name, count, mean, p50, p99, errors in summary[:20]))
 
 
 @BOT.command(name='summon-him', brief='Summons Picklechu from the void')
@@ -31,4 +81,5 @@ async def change_reminder_server(ctx, server_name):
     so this is an easy way to update it without having to change the source code"""
 
     dotenv.set_key('/home/pi/.env', 'REMINDER', server_name)
+    os.environ['REMINDER'] = server_name  # The scheduled reminders look the server up each time they are sent
     await ctx.channel.send(f"Group reminders will now be send to the server {server_name}")
@@ -0,0 +1,60 @@
+from typing import Iterable, Iterator, List
+
+MESSAGE_LIMIT = 2000  # The most characters discord allows in a single message
+PAGE_MARKER_ROOM = 20  # Kept free on every page for the page marker, like \n*(page 12/34)*
+
+
+def pieces(block: str, room: int) -> Iterator[str]:
+    """Splits a block too long for one message into its lines, cutting up any line that is still too long"""
+
+    if len(block) <= room:
+        yield block
+        return
+
+    for line in block.split('\n'):
+        for start in range(0, max(len(line), 1), room):
+            yield line[start:start + room]
+
+
+def paginate(blocks: Iterable[str], header: str = '', limit: int = MESSAGE_LIMIT) -> List[str]:
+    """
+    Packs blocks of text, one per line, into as few messages as fit within the limit. A block is only split over
+    two messages if it does not fit in one on its own, and when there is more than one message each gets a page marker
+
+    Parameters:
+        blocks - The blocks of text to send, in order, such as the quote/author pairs of a quote or a list of names
+        header - A line to start the first message with
+        limit - The most characters a message can have
+
+    Returns:
+        pages - The text of every message to send
+    """
+
+    room = limit - PAGE_MARKER_ROOM
+    pages = list()
+    page = header[:room]
+
+    for block in blocks:
+        for piece in pieces(block, room):
+            if not page:
+                page = piece
+            elif len(page) + 1 + len(piece) <= room:
+                page += '\n' + piece
+            else:
+                pages.append(page)
+                page = piece
+
+    if page:
+        pages.append(page)
+
+    if len(pages) > 1:
+        pages = [f'{page}\n*(page {number}/{len(pages)})*' for number, page in enumerate(pages, start=1)]
+
+    return pages
+
+
+async def send_paginated(channel, blocks: Iterable[str], header: str = '') -> None:
+    """Sends blocks of text to a channel in as few messages as possible, see paginate"""
+
+    for page in paginate(blocks, header):
+        await channel.send(page)
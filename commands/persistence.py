@@ -0,0 +1,106 @@
+import asyncio
+import json
+import os
+import stat
+import tempfile
+import traceback
+from contextlib import contextmanager
+from pathlib import Path
+from typing import IO, Any, Callable, Iterator, Set
+
+
+@contextmanager
+def atomic_write(path: Path, mode: str = 'w', durable: bool = False) -> Iterator[IO]:
+    """
+    Opens a temporary file next to the given file for writing, and once the with block finishes renames it over the
+    original in one step, so anyone reading the file only ever sees the old or the new contents. If the block raises
+    the temporary file is thrown away and the original is left untouched. The new file keeps the permissions of the
+    one it replaces, since temporary files are only readable by their owner
+
+    Parameters:
+        path - The file to replace
+        mode - The mode to open the temporary file with, 'w' or 'wb'
+        durable - Whether to flush the new contents to disk before the rename, for files that cannot be rebuilt
+
+    Returns:
+        file - The open temporary file to write the new contents to
+    """
+
+    path = Path(path)
+
+    with tempfile.NamedTemporaryFile(mode, dir=path.parent, prefix=f'.{path.name}.', delete=False) as temp:
+        try:
+            if path.exists():
+                os.chmod(temp.name, stat.S_IMODE(path.stat().st_mode))
+            yield temp
+            if durable:
+                temp.flush()
+                os.fsync(temp.fileno())
+        except BaseException:
+            temp.close()
+            os.remove(temp.name)
+            raise
+
+    os.replace(temp.name, path)
+
+
+def save_json(path: Path, data: Any) -> None:
+    """Atomically writes some data to a JSON file"""
+
+    with atomic_write(path) as file:
+        json.dump(data, file)
+
+
+class DebouncedSave:
+    """
+    Runs a save function a little while after the first change that needs saving, so a burst of changes only costs a
+    single write. Saving straight away as well is harmless, the scheduled save just writes the same state again. Every
+    save that is still waiting is kept in PENDING, so flush_pending_saves can write them out when the bot shuts down.
+    """
+
+    def __init__(self, save: Callable[[], None], delay: float) -> None:
+
+        self.save = save
+        self.delay = delay
+        self._handle = None
+
+    def __call__(self) -> None:
+        """Schedules a save unless one is already coming up, saving straight away if there is no event loop"""
+
+        if self._handle is not None:
+            return
+
+        try:
+            self._handle = asyncio.get_event_loop().call_later(self.delay, self._run)
+            PENDING.add(self)
+        except RuntimeError:  # There is no event loop to schedule on so just save straight away
+            self.save()
+
+    def _run(self) -> None:
+        self._handle = None
+        PENDING.discard(self)
+        self.save()
+
+    def flush(self) -> None:
+        """Saves straight away if a save is waiting, instead of when it was scheduled for"""
+
+        if self._handle is not None:
+            self._handle.cancel()
+            self._run()
+
+
+PENDING: Set[DebouncedSave] = set()  # The debounced saves that are scheduled but have not run yet
+
+
+def flush_pending_saves() -> None:
+    """
+    Runs every debounced save that is still waiting, since stopping the event loop drops them along with everything
+    else it had scheduled. One failing save is reported rather than stopping the others from being written
+    """
+
+    for pending in list(PENDING):
+        try:
+            pending.flush()
+        except Exception:
+            print('Could not save on shutdown:')
+            traceback.print_exc()
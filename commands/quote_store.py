@@ -0,0 +1,355 @@
+import csv
+import hashlib
+import os
+import sys
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from commands.fuzzy_index import FuzzyIndex
+from commands.persistence import atomic_write
+
+
+Quote = Tuple[str, ...]  # A quote row of the form (quote, author, quote, author, ...)
+ContentKey = Tuple[str, ...]  # The normalized form of a quote row used to detect duplicates
+
+
+def split_authors(field: str) -> List[str]:
+    """Splits an author column into the individual people it names, so 'Bob & Mary' becomes ['Bob', 'Mary']"""
+    return [name.strip() for name in field.split(' & ') if name.strip()]
+
+
+def authors_of(quote: Quote) -> List[str]:
+    """Gets every individual author named in a quote, with co-authored lines split into each person"""
+    return [author for index in range(1, len(quote), 2) for author in split_authors(quote[index])]
+
+
+def content_key(quote: Iterable[str]) -> ContentKey:
+    """
+    Normalizes a quote into the key we use to decide if two quotes are the same. Every string is casefolded with its
+    whitespace collapsed, and co-authors are put into a fixed order so 'Bob & Mary' and 'mary & bob' are equal
+
+    Parameters:
+        quote - The quote/author pairs to normalize
+
+    Returns:
+        key - A hashable tuple that is equal for any two quotes that only differ in case or spacing
+    """
+
+    key = list()
+
+    for index, string in enumerate(quote):
+        if index % 2:
+            key.append(' & '.join(sorted(' '.join(name.split()).casefold() for name in split_authors(string))))
+        else:
+            key.append(' '.join(string.split()).casefold())
+
+    return tuple(key)
+
+
+def fingerprint(quote: Iterable[str]) -> str:
+    """Hashes the normalized content of a quote into a short stable id, equal for any two duplicate quotes"""
+    return hashlib.blake2b('\x1f'.join(content_key(quote)).encode(), digest_size=8).hexdigest()
+
+
+class QuoteStore:
+    """
+    An in-memory copy of the quotes database CSV. The file is parsed once when the store is created and every
+    row is kept as a tuple of interned strings under a numeric row id. Alongside the rows we keep an inverted index
+    of author -> row ids, built after splitting the ' & ' co-author names, so looking up someone's quotes only
+    costs as much as the number of quotes they have rather than a scan of the whole file. We also keep a hash table
+    of the fingerprint of every row's normalized content, so checking for a duplicate quote is a single lookup and
+    quotes can be referred to by a stable id.
+
+    Deleting a quote never rewrites the database straight away. Instead the deleted row is appended as a tombstone to
+    a journal that sits next to the CSV, and the tombstones are replayed whenever the store is loaded. Once enough
+    tombstones pile up the CSV is compacted, which is safe to run off the event loop. The first line of the journal
+    records the inode of the CSV it belongs to, so a journal left behind by a compaction that crashed before clearing
+    it is recognised as stale and ignored instead of being replayed against the new file.
+    """
+
+    def __init__(self, csv_file: str, compaction_threshold: int = 50) -> None:
+
+        self.csv_file = Path(csv_file)
+        self.journal_file = self.csv_file.with_name(f'{self.csv_file.name}.journal')
+        self.compaction_threshold = compaction_threshold
+        self._tombstones = 0
+        self._stale_journal = False  # Whether the journal belongs to an older CSV, so the next delete starts a new one
+        self._rows: List[Optional[Quote]] = list()
+        self._authors: Dict[str, Set[int]] = defaultdict(set)
+        self._content: Dict[str, Set[int]] = defaultdict(set)
+        self._count = 0
+        self._fuzzy = None
+        self.version = 0  # Goes up on every add or delete, so anything derived from the quotes knows when it is stale
+
+        if self.csv_file.exists():
+            with open(self.csv_file, 'r') as college_quotes:
+                for row in csv.reader(college_quotes):
+                    if row:
+                        self._insert(row)
+
+        self._replay_journal()
+
+    def _csv_generation(self) -> str:
+        """Identifies the current CSV file, this changes whenever compaction swaps in a new file but not on appends"""
+        return str(os.stat(self.csv_file).st_ino)
+
+    def _replay_journal(self) -> None:
+        """Applies every tombstone in the journal to the rows we just loaded, ignoring the journal if it is stale. It
+        is left in place since this store might only be reading, like the backup script, while the bot owns the file"""
+
+        if not self.journal_file.exists():
+            return
+
+        with open(self.journal_file, 'r') as journal:
+            entries = [row for row in csv.reader(journal) if row]
+
+        if not entries or not self.csv_file.exists() or entries[0] != ['#generation', self._csv_generation()]:
+            self._stale_journal = True
+            return
+
+        for tombstone in entries[1:]:
+            row_ids = self._content.get(fingerprint(tombstone))
+            if row_ids:
+                self._delete(min(row_ids))
+            self._tombstones += 1
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _insert(self, row: Iterable[str]) -> int:
+        """Adds a row to the in-memory copy and indexes it under every author it names, returning its row id"""
+
+        quote = tuple(sys.intern(string) for string in row)
+        row_id = len(self._rows)
+        self._rows.append(quote)
+        self._count += 1
+        self.version += 1
+        self._content[fingerprint(quote)].add(row_id)
+
+        if self._fuzzy is not None:
+            self._fuzzy.add(row_id, quote)
+
+        for author in self.authors_of(quote):
+            self._authors[author.casefold()].add(row_id)
+
+        return row_id
+
+    def _delete(self, row_id: int) -> Quote:
+        """Removes a row from the in-memory copy and from the author index, returning the removed row"""
+
+        quote = self._rows[row_id]
+        self._rows[row_id] = None
+        self._count -= 1
+        self.version += 1
+
+        key = fingerprint(quote)
+        self._content[key].discard(row_id)
+        if not self._content[key]:
+            del self._content[key]
+
+        if self._fuzzy is not None:
+            self._fuzzy.remove(row_id)
+
+        for author in self.authors_of(quote):
+            key = author.casefold()
+            self._authors[key].discard(row_id)
+            if not self._authors[key]:
+                del self._authors[key]
+
+        return quote
+
+    authors_of = staticmethod(authors_of)
+
+    def rows(self) -> List[Quote]:
+        """Gets every quote currently in the database"""
+        return [row for row in self._rows if row is not None]
+
+    def quotes_by(self, author: str) -> List[Quote]:
+        """
+        Gets every quote that names the given author in any of its author columns, or every quote in the database
+        if the author is 'random'
+
+        Parameters:
+            author - The name of the author to get the quotes for, case does not matter
+
+        Returns:
+            quotes - A list of tuples of all the quotes by this author
+        """
+
+        if author == 'random':
+            return self.rows()
+
+        return [self._rows[row_id] for row_id in sorted(self._authors.get(author.casefold(), ()))]
+
+    def snapshot(self) -> List[Optional[Quote]]:
+        """Copies the list of rows, with None for deleted ones, so they can be read from another thread"""
+        return list(self._rows)
+
+    @staticmethod
+    def build_fuzzy_index(rows: List[Optional[Quote]]) -> FuzzyIndex:
+        """Builds the fuzzy search index of a snapshot of the rows, this only reads the snapshot so it can take its
+        time in an executor while the store keeps changing"""
+
+        index = FuzzyIndex()
+
+        for row_id, row in enumerate(rows):
+            if row is not None:
+                index.add(row_id, row)
+
+        return index
+
+    def use_fuzzy_index(self, index: FuzzyIndex, rows: List[Optional[Quote]]) -> None:
+        """Starts searching with an index built from a snapshot of the rows, first catching it up on every quote that
+        was added or deleted since the snapshot was taken"""
+
+        if self._fuzzy is not None:
+            return
+
+        for row_id, row in enumerate(rows):
+            if row is not None and self._rows[row_id] is None:
+                index.remove(row_id)
+
+        for row_id in range(len(rows), len(self._rows)):
+            if self._rows[row_id] is not None:
+                index.add(row_id, self._rows[row_id])
+
+        self._fuzzy = index
+
+    def closest_match(self, author: str, phrase: str) -> Optional[Quote]:
+        """
+        Gets the quote by an author that best matches a phrase. The bot builds the fuzzy search index in the background
+        when it starts, anything else using the store builds it here the first time it is needed, and from then on it
+        is kept up to date as quotes are added and removed
+
+        Parameters:
+            author - The name of the author to search the quotes of, or 'random' to search every quote
+            phrase - The phrase we are trying to find the closest quote to
+
+        Returns:
+            quote - The closest quote, or None if the author has no quotes
+        """
+
+        if self._fuzzy is None:
+            rows = self.snapshot()
+            self.use_fuzzy_index(self.build_fuzzy_index(rows), rows)
+
+        row_ids = None if author == 'random' else self._authors.get(author.casefold(), ())
+        row_id = self._fuzzy.closest(phrase, row_ids)
+
+        return None if row_id is None else self._rows[row_id]
+
+    def contains(self, quote: Iterable[str]) -> bool:
+        """Checks if a quote with the exact same content, ignoring case and spacing, is already in the database"""
+        return fingerprint(quote) in self._content
+
+    def get(self, key: str) -> Optional[Quote]:
+        """Gets the quote with the given fingerprint, or None if it is no longer in the database"""
+        row_ids = self._content.get(key)
+        return self._rows[min(row_ids)] if row_ids else None
+
+    def add(self, quote: Iterable[str]) -> Quote:
+        """
+        Appends a new quote to the database file and to the in-memory index, the authors are title cased to keep
+        the database homogeneous
+
+        Parameters:
+            quote - The quote/author pairs to add to the database
+
+        Returns:
+            row - The row exactly as it was written to the database
+        """
+
+        row = [s.title() if i % 2 else s for i, s in enumerate(quote)]
+
+        with open(self.csv_file, 'a') as college_quotes:
+            csv.writer(college_quotes, quoting=csv.QUOTE_ALL).writerow(row)
+
+        return self._rows[self._insert(row)]
+
+    def matching(self, partial_quote: Quote) -> List[int]:
+        """
+        Finds the row ids of every quote that begins with the given quote/author pairs, compared without regard to
+        case. Only rows naming the first given author are considered, so the index narrows the search for us
+
+        Parameters:
+            partial_quote - The leading quote/author pairs of the quotes we are looking for
+
+        Returns:
+            row_ids - The ids of all matching rows in database order
+        """
+
+        if len(partial_quote) < 2:
+            return list()
+
+        candidates = [self._authors.get(author.casefold(), set()) for author in split_authors(partial_quote[1])]
+        candidates = set.intersection(*candidates) if candidates else set()
+
+        return [row_id for row_id in sorted(candidates) if all(
+            string.lower() == partial.lower() for string, partial in zip(self._rows[row_id], partial_quote))]
+
+    def remove(self, partial_quote: Quote) -> List[Quote]:
+        """
+        Removes every quote that begins with the given quote/author pairs from the database. The removed rows are
+        appended to the journal as tombstones rather than rewriting the database file
+
+        Parameters:
+            partial_quote - The leading quote/author pairs of the quotes to remove
+
+        Returns:
+            removed - The rows that were removed, empty if no quote matched
+        """
+
+        removed = [self._delete(row_id) for row_id in self.matching(partial_quote)]
+
+        if removed:
+
+            new_journal = self._stale_journal or not self.journal_file.exists()
+
+            with open(self.journal_file, 'w' if new_journal else 'a') as journal:
+
+                writer = csv.writer(journal, quoting=csv.QUOTE_ALL)
+
+                if new_journal:
+                    writer.writerow(['#generation', self._csv_generation()])
+
+                writer.writerows(removed)
+                journal.flush()
+                os.fsync(journal.fileno())
+
+            self._tombstones += len(removed)
+            self._stale_journal = False
+
+        return removed
+
+    @property
+    def needs_compaction(self) -> bool:
+        """Whether enough tombstones have built up in the journal that the database file should be rewritten"""
+        return self.compaction_threshold <= self._tombstones
+
+    def compact(self) -> None:
+        """
+        Rewrites the database file with only the live rows and then clears the journal. The new file is written to a
+        temporary file in the same folder, flushed to disk and then atomically swapped in, so a crash at any point
+        leaves either the old file and its journal or the new file. This does blocking I/O so it is meant to be run in
+        an executor, and nothing else may write to the store while it runs.
+        """
+
+        rows = self.rows()
+        folder = self.csv_file.parent
+
+        with atomic_write(self.csv_file, durable=True) as temp:
+            csv.writer(temp, quoting=csv.QUOTE_ALL).writerows(rows)
+
+        # Make sure the rename itself has hit the disk before we throw away the journal it supersedes
+        if hasattr(os, 'O_DIRECTORY'):
+            folder_fd = os.open(folder, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(folder_fd)
+            finally:
+                os.close(folder_fd)
+
+        if self.journal_file.exists():
+            self.journal_file.unlink()
+
+        self._tombstones = 0
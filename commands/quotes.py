@@ -1,46 +1,69 @@
-import csv
-import random
-from typing import List, Tuple
+import asyncio
+import traceback
 from pathlib import Path
+from typing import Optional, Tuple
 
 from discord import raw_models
-from fuzzywuzzy import fuzz
 
 from commands import *
+from commands.metrics import METRICS
+from commands.output import send_paginated
+from commands.quote_store import QuoteStore, authors_of, fingerprint
+from commands.rotation import ShuffleBag
+from commands.scoreboard import SCOREBOARD
+from commands.sqlite_store import SqliteQuoteStore
 
-SEEN_QUOTES = set()  # A global variable that keeps track of all 'stale' quotes
+WRITE_LOCK = asyncio.Lock()  # Serializes writes to the quotes database so they never overlap with a compaction
 
+# The quotes database, either loaded into memory once when the bot starts or kept in SQLite if configured
+QUOTES = SqliteQuoteStore(SQLITE_FILE, import_from=CSV_FILE) if SQLITE_FILE else QuoteStore(CSV_FILE)
 
-def all_quotes_by(author: str) -> List[Tuple[str]]:
+# The no-repeat rotation of everyone's quotes, so we cannot re-see a quote until we have gone through all of them
+ROTATION = ShuffleBag(str(Path(STATE_PATH, 'quote-rotation.json')))
+
+
+def next_quote_by(author: str) -> Optional[Tuple[str]]:
     """
-    Get all the quotes by a specified person, removing from the possible pool all quotes that have been seen on this
-    rotation of the quote cycle. Meaning we cannot re-see a quote until we have gone through all of their quotes first.
-    Returns a list of tuples of a person's quotes
+    Get the next quote by a specified person in their rotation of the quote cycle, meaning we cannot re-see a quote
+    until we have gone through all of their quotes first. Every person, and 'random' for everyone, has their own
+    pre-shuffled rotation so this does not have to look at any of their other quotes
 
     Parameters:
-        author - The name of the author to get all of the unseen quotes for
+        author - The name of the author to get the next quote for
 
     Returns:
-        quotes - A list of tuples of all quotes by this author that are currently unseen
+        quote - A tuple of the next quote by this author, or None if they have no quotes
     """
 
-    global SEEN_QUOTES  # Make sure we can edit the global set if applicable
+    with METRICS.span('quotes.next_quote_by'):
+        key = ROTATION.draw(author.casefold(), lambda: [fingerprint(quote) for quote in QUOTES.quotes_by(author)],
+                            lambda quote_key: QUOTES.get(quote_key) is not None)
+
+        return None if key is None else QUOTES.get(key)
+
+
+COMPACTION = None  # The background rewrite of the quotes database, if one has been started
+
+SEARCH_INDEX = None  # The background build of the phrase search index, started once we first connect
+
 
-    with open(CSV_FILE, 'r') as college_quotes:
+async def load_search_index() -> None:
+    """Builds the phrase search index of the in-memory quotes in an executor and then starts searching with it"""
 
-        all_quotes = set()
+    rows = QUOTES.snapshot()
+    index = await asyncio.get_event_loop().run_in_executor(None, QuoteStore.build_fuzzy_index, rows)
+    QUOTES.use_fuzzy_index(index, rows)
 
-        for quote in csv.reader(college_quotes):
-            if author == 'random' or any(author.title() in quote[i] for i in range(1, len(quote), 2)):
-                all_quotes.add(tuple(quote))
 
-        remove_duplicates = all_quotes - SEEN_QUOTES
+@BOT.listen('on_ready')
+async def build_search_index() -> None:
+    """Starts building the phrase search index once we are connected, so no $quote search ever has to build it on the
+    event loop. SQLite keeps its own full text index so there is nothing to build for it"""
 
-        if not remove_duplicates:
-            SEEN_QUOTES -= all_quotes
-            return list(all_quotes)
+    global SEARCH_INDEX
 
-        return list(remove_duplicates)
+    if SEARCH_INDEX is None and isinstance(QUOTES, QuoteStore):
+        SEARCH_INDEX = asyncio.ensure_future(load_search_index())
 
 
 @BOT.command(name='add-quote', brief='Adds a new quote to the database given a quote and an author')
@@ -63,17 +86,17 @@ async def save_quote(ctx, *quote) -> None:
         await ctx.channel.send('Malformed query, the quote should be in the form "quote" author "quote" author...')
         return
 
-    with open(CSV_FILE, 'r') as college_quotes:
+    if QUOTES.contains(quote):
+        await ctx.channel.send('This quote already exists in the database, no need to add it again.')
+        return
+
+    async with WRITE_LOCK:
+        row = QUOTES.add(quote)
 
-        for row in csv.reader(college_quotes):
-            if all([string.lower() == partial.lower() for string, partial in zip(row, quote)]):
-                await ctx.channel.send('This quote already exists in the database, no need to add it again.')
-                return
+    ROTATION.insert(['random'] + [author.casefold() for author in authors_of(row)], fingerprint(row))
+    SCOREBOARD.add_quote(row)
 
-    with open(CSV_FILE, 'a') as college_quotes:
-        writer = csv.writer(college_quotes, quoting=csv.QUOTE_ALL)
-        writer.writerow([s.title() if i % 2 else s for i, s in enumerate(quote)])
-        await ctx.channel.send('Successfully added quote to database for future usage')
+    await ctx.channel.send('Successfully added quote to database for future usage')
 
 
 @BOT.command(name='delete-quote', brief='Removes a mistyped or mis-associated quote from the database')
@@ -93,6 +116,8 @@ async def remove_quote(ctx, *quote) -> None:
         Nothing
     """
 
+    global COMPACTION  # Kept so the background compaction is not garbage collected, and never started twice
+
     if ctx.message.author.name != 'Bob the Great':
         await ctx.channel.send(f"Nice try, {ctx.message.author.mention}, but this is only for emergencies")
         return
@@ -101,27 +126,41 @@ async def remove_quote(ctx, *quote) -> None:
         await ctx.channel.send("You either didn't give a quote to delete or the quote's formatted was malformed.")
         return
 
-    partial_quote = list(quote)
-
-    with open(CSV_FILE, 'r') as quotes_read, open('college-quotes-edited.csv', 'w') as quotes_write:
-
-        csv_writer = csv.writer(quotes_write, quoting=csv.QUOTE_ALL)
-        quote_removed = False
-
-        for row in csv.reader(quotes_read):
-            if not all([quote.lower() == partial.lower() for quote, partial in zip(row, partial_quote)]):
-                csv_writer.writerow(row)
-            else:
-                quote_removed = True
+    async with WRITE_LOCK:
+        removed = QUOTES.remove(quote)
 
-    Path(CSV_FILE).unlink()
-    Path('college-quotes-edited.csv').rename(CSV_FILE)
+    for row in removed:
+        SCOREBOARD.remove_quote(row)
 
-    if quote_removed:
+    if removed:
         await ctx.channel.send("Quote successfully removed from the database!")
     else:
         await ctx.channel.send("Quote was not found in the database, are you sure it is correct?")
 
+    if QUOTES.needs_compaction and (COMPACTION is None or COMPACTION.done()):
+        COMPACTION = asyncio.ensure_future(compact_quotes())
+
+
+async def compact_quotes() -> None:
+    """
+    Rewrites the quotes database without the quotes that have been deleted since the last compaction. The rewrite
+    happens in a background thread so other commands keep being served, only writes to the database have to wait
+
+    Parameters:
+        Nothing
+
+    Returns:
+        Nothing
+    """
+
+    async with WRITE_LOCK:
+        if QUOTES.needs_compaction:
+            try:
+                await asyncio.get_event_loop().run_in_executor(None, QUOTES.compact)
+            except Exception:  # The journal is still there, so the next delete just tries again
+                print('Compacting the quotes database failed:')
+                traceback.print_exc()
+
 
 @BOT.command(name='quote', brief='Fetches a random quote by a specified person or anyone if left unfilled')
 @lock_to_channel(CHANNEL_LOCK)
@@ -139,24 +178,23 @@ async def get_quote(ctx, quote_author='random', closest_match=None) -> None:
         Nothing
     """
 
-    quotes_list = all_quotes_by(quote_author)
+    if closest_match is not None:
+        if SEARCH_INDEX is not None and not SEARCH_INDEX.done():
+            await asyncio.wait({SEARCH_INDEX})  # Wait for the index to be built rather than building it here
 
-    if quotes_list:
+        with METRICS.span('quotes.closest_match'):
+            quote = QUOTES.closest_match(quote_author, closest_match)
+    else:
+        quote = next_quote_by(quote_author)
 
-        if closest_match is not None:
-            joined_quotes = [' '.join([l for i, l in enumerate(q) if not i % 2]) for q in quotes_list]
-            raw_quotes = [(i, fuzz.token_set_ratio(q, closest_match)) for i, q in enumerate(joined_quotes)]
-            best_match = max(raw_quotes, key=lambda q: q[1])
-            quote = quotes_list[best_match[0]]
-        else:
-            quote = random.SystemRandom().choice(quotes_list)
+    if quote is not None:
 
         quote_list = [(quote[i], quote[i + 1]) for i in range(0, len(quote), 2)]
-        SEEN_QUOTES.add(tuple(quote))
 
-        for quotation, author in quote_list:
-            await ctx.channel.send(f'**"{quotation}"**\n'
-                                   f'-*{author.title()}*')
+        # Every pair of a conversation goes in the same message, unless it is too long for discord
+        with METRICS.span('discord.send'):
+            await send_paginated(ctx.channel, (f'**"{quotation}"**\n-*{author.title()}*'
+                                               for quotation, author in quote_list))
 
     else:
         await ctx.channel.send(f'{quote_author} not found in the database. Add some quotes for them!')
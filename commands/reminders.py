@@ -0,0 +1,124 @@
+import asyncio
+import io
+import os
+import random
+import time
+from functools import lru_cache
+from pathlib import Path
+
+import discord
+
+from commands import *
+from commands.scheduler import Scheduler
+
+# The reminders the bot sends on a schedule, as name -> the channel they are sent to
+REMINDER_CHANNELS = {'Break': 'general', 'Checkin': 'reminders', 'Daily': 'general'}
+
+# Runs the reminders on their cron schedules from inside the bot, carrying on where it left off after a restart
+SCHEDULER = Scheduler(str(Path(STATE_PATH, 'reminder-schedule.json')))
+
+
+@lru_cache(maxsize=1)
+def break_reminder_template():
+    """Loads the font and draws the parts of the break reminder that never change, only the first time it is sent"""
+
+    from PIL import Image, ImageFont, ImageDraw  # Only the break reminder draws anything so only it loads Pillow
+
+    with Image.open(Path(RESOURCES_PATH, 'babe-its-time.png')) as image:
+        template = image.copy()
+
+    font = ImageFont.truetype(str(Path(RESOURCES_PATH, 'dejavu.ttf')), 40)
+    ImageDraw.Draw(template).text((700, 575), 'Yes honey', fill=(0, 0, 0), font=font)
+
+    return template, font
+
+
+@lru_cache(maxsize=8)
+def render_break_reminder(clock: str) -> bytes:
+    """Draws the time onto a copy of the break reminder template, the same time is only ever drawn once"""
+
+    from PIL import ImageDraw
+
+    template, font = break_reminder_template()
+    image = template.copy()
+
+    ImageDraw.Draw(image).text((25, 650), f"Babe! It's {clock}, time\nfor you to take a break", fill=(0, 0, 0),
+                               font=font)
+
+    buffer = io.BytesIO()
+    image.save(buffer, 'PNG', compress_level=1)  # Encoding is most of the work, and the fastest level is plenty here
+
+    return buffer.getvalue()
+
+
+async def prerender_break_reminder() -> None:
+    """Draws the break reminder for the next time it is scheduled ahead of time, so sending it is just an upload"""
+
+    next_break = SCHEDULER.next_runs().get('Break')
+
+    if next_break is not None:
+        await asyncio.get_event_loop().run_in_executor(None, render_break_reminder, next_break.strftime('%I:%M%p'))
+
+
+async def break_reminder(channel) -> None:
+    """A function to send a 'Babe its Time' meme in the chat to tell people to take their scheduled break from
+    STEM homework and actually live a little"""
+
+    image = await asyncio.get_event_loop().run_in_executor(None, render_break_reminder, time.strftime('%I:%M%p'))
+    await channel.send('@everyone Stop it, get some help', file=discord.File(io.BytesIO(image), 'reminder.png'))
+
+    await prerender_break_reminder()
+
+
+async def checkin_reminder(channel) -> None:
+    """Waits a random amount of time after the break started and then asks everyone to check she is taking it"""
+
+    await asyncio.sleep(random.SystemRandom().randint(10, 55) * 60)
+    await channel.send("@everyone Go check in and make sure she's actually taking her break.")
+
+
+async def daily_reminder(channel) -> None:
+    """Asks everyone to share the best part of their day"""
+
+    await channel.send("@everyone It's that time of day again, please send the best part of your day in chat "
+                       "so we can all feel a little better :)")
+
+
+REMINDERS = {'Break': break_reminder, 'Checkin': checkin_reminder, 'Daily': daily_reminder}
+
+
+async def send_reminder(client, name: str) -> None:
+    """
+    Sends one of the reminders to its channel in the reminder server. The server is looked up when the reminder is
+    sent since it can be changed with $change-reminders while the bot is running
+
+    Parameters:
+        client - The logged in discord client to send the reminder with
+        name - The name of the reminder to send, one of Break, Checkin or Daily
+
+    Returns:
+        Nothing
+    """
+
+    server = discord.utils.find(lambda s: s.name == os.getenv('REMINDER'), client.guilds)
+    channel = discord.utils.find(lambda c: c.name == REMINDER_CHANNELS[name], server.channels)
+
+    await REMINDERS[name](channel)
+
+
+@BOT.listen('on_ready')
+async def start_reminders() -> None:
+    """Schedules every reminder that has a cron expression in the .env file, the first time the bot connects"""
+
+    if SCHEDULER.next_runs():  # We reconnected, the scheduler is already running
+        return
+
+    for name, expression in REMINDER_SCHEDULES.items():
+        if expression:
+            try:
+                SCHEDULER.add(name, expression, lambda name=name: send_reminder(BOT, name))
+            except ValueError as error:  # A typo in one schedule should not stop the other reminders
+                print(f'Not scheduling the {name} reminder: {error}')
+
+    SCHEDULER.start()
+    await prerender_break_reminder()
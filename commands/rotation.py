@@ -0,0 +1,86 @@
+import json
+import random
+from collections import deque
+from pathlib import Path
+from typing import Callable, Deque, Dict, Iterable, Optional
+
+from commands.persistence import DebouncedSave, save_json
+
+
+class ShuffleBag:
+    """
+    A no-repeat rotation over named pools of items, such as everyone's quotes or one person's memes. Each pool is a
+    pre-shuffled deque of item keys that we pop from in O(1), and only once a pool runs dry do we reshuffle everything
+    in it for the next cycle, so nothing repeats until the whole pool has been seen. Items added mid-cycle are slotted
+    into a random spot of the pools they belong to, and items removed mid-cycle are skipped when they come up. The
+    remaining order of every pool is saved to a small JSON file so the rotation survives restarts of the bot.
+    """
+
+    def __init__(self, state_file: str = None, save_delay: float = 30.) -> None:
+
+        self.state_file = None if state_file is None else Path(state_file)
+        self.save_delay = save_delay
+        self._bags: Dict[str, Deque[str]] = dict()
+        self._random = random.SystemRandom()
+        self._save_soon = DebouncedSave(self.save, save_delay)
+
+        if self.state_file is not None and self.state_file.exists():
+            with open(self.state_file, 'r') as state:
+                self._bags = {pool: deque(keys) for pool, keys in json.load(state).items()}
+
+    def draw(self, pool: str, refill: Callable[[], Iterable[str]], is_live: Callable[[str], bool]) -> Optional[str]:
+        """
+        Pops the next item of a pool, starting a freshly shuffled cycle if the pool has been exhausted
+
+        Parameters:
+            pool - The name of the pool to draw from
+            refill - A function giving the keys of every item currently in the pool, only called to start a new cycle
+            is_live - A function telling us if a key is still in the pool, so we can skip items removed mid-cycle
+
+        Returns:
+            key - The key of the drawn item, or None if the pool is empty
+        """
+
+        bag = self._bags.get(pool)
+
+        while bag:
+            key = bag.popleft()
+            if is_live(key):
+                self.save_soon()
+                return key
+
+        keys = list(refill())
+
+        if not keys:
+            self._bags.pop(pool, None)
+            return None
+
+        self._random.shuffle(keys)
+        bag = self._bags[pool] = deque(keys)
+        key = bag.popleft()
+
+        self.save_soon()
+        return key
+
+    def insert(self, pools: Iterable[str], key: str) -> None:
+        """Slots a newly added item into a random spot of every pool it belongs to that is currently mid-cycle"""
+
+        for pool in pools:
+            bag = self._bags.get(pool)
+            if bag is not None:
+                bag.insert(self._random.randint(0, len(bag)), key)
+
+        self.save_soon()
+
+    def save_soon(self) -> None:
+        """Schedules the state to be saved shortly, so a burst of draws only costs a single write"""
+        if self.state_file is not None:
+            self._save_soon()
+
+    def save(self) -> None:
+        """Atomically writes the remaining order of every pool to the state file"""
+
+        if self.state_file is None:
+            return
+
+        save_json(self.state_file, {pool: list(bag) for pool, bag in self._bags.items()})
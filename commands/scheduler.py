@@ -0,0 +1,200 @@
+import asyncio
+import json
+import traceback
+from datetime import date, datetime, time, timedelta
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+from commands.persistence import save_json
+
+
+def parse_field(field: str, low: int, high: int) -> List[int]:
+    """
+    Parses one field of a cron expression, which is a comma separated list of *, a number or a range of numbers,
+    each optionally followed by a /step. Like cron, a single number with a step runs from that number to the end of
+    the field's range, so 5/10 in the minutes is 5, 15, 25, 35, 45 and 55
+
+    Parameters:
+        field - The text of the field, like '*/15' or '1-5' or '0,30'
+        low - The smallest value the field can take
+        high - The largest value the field can take
+
+    Returns:
+        values - Every value the field matches, in ascending order
+    """
+
+    values = set()
+
+    for part in field.split(','):
+
+        span, _, step = part.partition('/')
+
+        if span == '*':
+            start, end = low, high
+        elif '-' in span:
+            start, end = (int(bound) for bound in span.split('-', 1))
+        else:
+            start = int(span)
+            end = high if step else start
+
+        if not low <= start <= end <= high or (step and int(step) < 1):
+            raise ValueError(f'Cron field {field} is out of the range {low}-{high}')
+
+        values.update(range(start, end + 1, int(step) if step else 1))
+
+    return sorted(values)
+
+
+class CronSchedule:
+    """
+    A standard five field cron expression, minute hour day-of-month month day-of-week, in local time. Like cron, when
+    both the day of the month and the day of the week are restricted a day matching either one of them is a match
+    """
+
+    def __init__(self, expression: str) -> None:
+
+        fields = expression.split()
+
+        if len(fields) != 5:
+            raise ValueError(f'Cron expression {expression} should have five fields')
+
+        self.expression = ' '.join(fields)
+        self.minutes = parse_field(fields[0], 0, 59)
+        self.hours = parse_field(fields[1], 0, 23)
+        self.days = set(parse_field(fields[2], 1, 31))
+        self.months = set(parse_field(fields[3], 1, 12))
+        self.weekdays = {day % 7 for day in parse_field(fields[4], 0, 7)}  # Both 0 and 7 are Sunday
+        self._any_day = fields[2].startswith('*')  # Cron counts a field starting with *, like */2, as unrestricted
+        self._any_weekday = fields[4].startswith('*')
+
+    def _matches_day(self, day: date) -> bool:
+        """Checks if the schedule runs at all on a given day"""
+
+        if day.month not in self.months:
+            return False
+
+        in_days = day.day in self.days
+        in_weekdays = day.isoweekday() % 7 in self.weekdays
+
+        if self._any_day or self._any_weekday:
+            return in_days and in_weekdays
+
+        return in_days or in_weekdays
+
+    def next_after(self, moment: datetime) -> datetime:
+        """Gets the first time strictly after the given moment that this schedule runs"""
+
+        moment = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        day = moment.date()
+
+        for _ in range(5 * 366):  # Even a schedule only running on the 29th of February runs within five years
+
+            if self._matches_day(day):
+                for hour in self.hours:
+                    for minute in self.minutes:
+                        candidate = datetime.combine(day, time(hour, minute))
+                        if moment <= candidate:
+                            return candidate
+
+            day += timedelta(days=1)
+
+        raise ValueError(f'Cron expression {self.expression} never runs')
+
+
+class Scheduler:
+    """
+    Runs named jobs inside the bot on cron schedules, so they share the bot's one connection to Discord instead of
+    each logging in from a separate process. A single background task sleeps until the next job is due. When a job
+    comes up its next run is worked out and saved before the job starts, so a crash or restart can never run it
+    twice, and after a restart jobs pick up from their saved next run. A job whose run was missed by more than the
+    grace period while the bot was down is skipped rather than sent late.
+    """
+
+    def __init__(self, state_file: str = None, grace: timedelta = timedelta(minutes=30)) -> None:
+
+        self.state_file = None if state_file is None else Path(state_file)
+        self.grace = grace
+        self._jobs: Dict[str, Tuple[CronSchedule, Callable[[], Awaitable]]] = dict()
+        self._next: Dict[str, datetime] = dict()
+        self._saved: Dict[str, Tuple[str, str]] = dict()
+        self._task = None
+
+        if self.state_file is not None and self.state_file.exists():
+            with open(self.state_file, 'r') as state:
+                self._saved = {name: tuple(entry) for name, entry in json.load(state).items()}
+
+    def add(self, name: str, expression: str, job: Callable[[], Awaitable]) -> None:
+        """
+        Schedules a job, carrying on from its saved next run if it had the same schedule the last time the bot ran
+
+        Parameters:
+            name - The name the job's next run is saved under
+            expression - The cron expression of when to run the job
+            job - The coroutine function to run
+
+        Returns:
+            Nothing
+        """
+
+        schedule = CronSchedule(expression)
+        now = datetime.now()
+        self._jobs[name] = schedule, job
+
+        saved_expression, saved_next = self._saved.get(name, (None, None))
+
+        if saved_expression == schedule.expression and now - self.grace <= datetime.fromisoformat(saved_next):
+            self._next[name] = datetime.fromisoformat(saved_next)
+        else:
+            self._next[name] = schedule.next_after(now)
+
+        self.save()
+
+    def next_runs(self) -> Dict[str, datetime]:
+        """Gets the next time every job is going to run"""
+        return dict(self._next)
+
+    def start(self) -> None:
+        """Starts the background task that runs the jobs, doing nothing if it is already running"""
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self) -> None:
+        """Sleeps until the next job is due, runs every job that is due, and repeats"""
+
+        while self._jobs:
+
+            now = datetime.now()
+            due = [name for name, at in self._next.items() if at <= now]
+
+            for name in due:
+                schedule, job = self._jobs[name]
+                self._next[name] = schedule.next_after(now)
+                asyncio.ensure_future(self._run_job(name, job))
+
+            if due:
+                self.save()
+
+            # Wake up at least once a minute so a change to the system clock is noticed soon after
+            delay = (min(self._next.values()) - datetime.now()).total_seconds()
+            await asyncio.sleep(min(max(delay, 0.), 60.))
+
+    @staticmethod
+    async def _run_job(name: str, job: Callable[[], Awaitable]) -> None:
+        """Runs a single job, reporting rather than propagating any error so one failure cannot stop the others"""
+
+        try:
+            await job()
+        except Exception:
+            print(f'Scheduled job {name} failed:')
+            traceback.print_exc()
+
+    def save(self) -> None:
+        """Atomically writes the schedule and next run of every job to the state file"""
+
+        self._saved.update({name: (self._jobs[name][0].expression, at.isoformat()) for name, at in self._next.items()})
+
+        if self.state_file is None:
+            return
+
+        save_json(self.state_file, self._saved)
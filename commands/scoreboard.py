@@ -0,0 +1,145 @@
+import json
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, Tuple
+
+from commands import STATE_PATH
+from commands.persistence import DebouncedSave, save_json
+from commands.quote_store import Quote, authors_of
+
+
+def meme_author_name(author: str) -> str:
+    """Gets the scoreboard name of a memes folder, which are lowercase, so they line up with the quote authors"""
+    return Path(author).stem.title()
+
+
+class Scoreboard:
+    """
+    A running count of every person's quotes and memes, so the leaderboard only has to look at one counter per person
+    instead of every quote and every meme. The counters are built from scratch once and from then on only adjusted as
+    quotes and memes are added and removed. They are saved to a small JSON file, together with the total number of
+    quotes and memes they were counted from, so on a cold start we can cheaply tell if the database changed while the
+    bot was not running and only recount the half of the scoreboard that went stale.
+    """
+
+    def __init__(self, state_file: str = None, save_delay: float = 30.) -> None:
+
+        self.state_file = None if state_file is None else Path(state_file)
+        self.save_delay = save_delay
+        self._quotes: Counter = Counter()
+        self._memes: Counter = Counter()
+        self._quote_total = self._meme_total = None  # Unknown until we have counted at least once
+        self._save_soon = DebouncedSave(self.save, save_delay)
+
+        if self.state_file is not None and self.state_file.exists():
+            with open(self.state_file, 'r') as state:
+                state = json.load(state)
+            self._quotes, self._quote_total = Counter(state['quotes']), state['quote_total']
+            self._memes, self._meme_total = Counter(state['memes']), state['meme_total']
+
+    def scores(self) -> Dict[str, Tuple[int, int]]:
+        """Gets every person's name -> (# Quotes, # Memes)"""
+        return {name: (self._quotes[name], self._memes[name]) for name in self._quotes.keys() | self._memes.keys()}
+
+    def in_sync(self, quote_total: int, meme_total: int) -> Tuple[bool, bool]:
+        """Checks if the quote and meme halves of the scoreboard were counted from databases of the given sizes"""
+        return self._quote_total == quote_total, self._meme_total == meme_total
+
+    def count_quotes(self, quotes: Iterable[Quote]) -> None:
+        """Recounts every person's quotes from scratch"""
+
+        self._quotes, self._quote_total = Counter(), 0
+
+        for quote in quotes:
+            self._quotes.update(authors_of(quote))
+            self._quote_total += 1
+
+        self.save_soon()
+
+    def count_memes(self, meme_counts: Dict[str, int]) -> None:
+        """Recounts every person's memes from scratch given the number of memes in each author's folder"""
+
+        self._memes = Counter()
+
+        for author, count in meme_counts.items():
+            self._memes[meme_author_name(author)] += count
+
+        self._memes += Counter()  # Drops the authors with empty folders
+        self._meme_total = sum(meme_counts.values())
+
+        self.save_soon()
+
+    def add_quote(self, quote: Quote, count: int = 1) -> None:
+        """Adjusts the counters of everyone in a quote that was just added, or removed if the count is negative"""
+
+        for author in authors_of(quote):
+            self._quotes[author] += count
+            if self._quotes[author] <= 0:
+                del self._quotes[author]
+
+        if self._quote_total is not None:
+            self._quote_total += count
+
+        self.save_soon()
+
+    def remove_quote(self, quote: Quote) -> None:
+        """Adjusts the counters of everyone in a quote that was just removed"""
+        self.add_quote(quote, -1)
+
+    def add_meme(self, author: str, count: int = 1) -> None:
+        """Adjusts the counter of the author of a meme that was just added, or removed if the count is negative"""
+
+        name = meme_author_name(author)
+        self._memes[name] += count
+        if self._memes[name] <= 0:
+            del self._memes[name]
+
+        if self._meme_total is not None:
+            self._meme_total += count
+
+        self.save_soon()
+
+    def remove_meme(self, author: str) -> None:
+        """Adjusts the counter of the author of a meme that was just removed"""
+        self.add_meme(author, -1)
+
+    def rebuild(self, quotes: Iterable[Quote], meme_counts: Dict[str, int]) -> Dict[str, Tuple[Tuple[int, int],
+                                                                                                 Tuple[int, int]]]:
+        """
+        Recounts the whole scoreboard from scratch and reports every person whose counters had drifted
+
+        Parameters:
+            quotes - Every quote in the database
+            meme_counts - The number of memes in every author's folder
+
+        Returns:
+            drift - The name -> ((# Quotes, # Memes) before, (# Quotes, # Memes) after) of every counter that changed
+        """
+
+        before = self.scores()
+
+        self.count_quotes(quotes)
+        self.count_memes(meme_counts)
+
+        after = self.scores()
+
+        return {name: (before.get(name, (0, 0)), after.get(name, (0, 0)))
+                for name in sorted(before.keys() | after.keys()) if before.get(name) != after.get(name)}
+
+    def save_soon(self) -> None:
+        """Schedules the counters to be saved shortly, so a burst of changes only costs a single write"""
+        if self.state_file is not None:
+            self._save_soon()
+
+    def save(self) -> None:
+        """Atomically writes the counters to the state file"""
+
+        if self.state_file is None:
+            return
+
+        save_json(self.state_file, {'quotes': self._quotes, 'quote_total': self._quote_total,
+                                    'memes': self._memes, 'meme_total': self._meme_total})
+
+
+# Shared by the quote and meme commands, which keep it up to date, and the leaderboard, which reads it
+SCOREBOARD = Scoreboard(str(Path(STATE_PATH, 'scoreboard.json')))
@@ -0,0 +1,303 @@
+import csv
+import re
+import sqlite3
+import sys
+from itertools import groupby
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+from commands.fuzzy_index import best_match, quote_text
+from commands.persistence import atomic_write
+from commands.quote_store import Quote, QuoteStore, authors_of, fingerprint, split_authors
+
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS quotes (
+        id INTEGER PRIMARY KEY,
+        fingerprint TEXT NOT NULL  -- The hash of the quote's normalized content, see quote_store.fingerprint
+    );
+    CREATE TABLE IF NOT EXISTS pairs (
+        quote_id INTEGER NOT NULL REFERENCES quotes(id) ON DELETE CASCADE,
+        position INTEGER NOT NULL,
+        quote TEXT NOT NULL,
+        author TEXT NOT NULL,
+        PRIMARY KEY (quote_id, position)
+    );
+    CREATE TABLE IF NOT EXISTS authors (
+        quote_id INTEGER NOT NULL REFERENCES quotes(id) ON DELETE CASCADE,
+        name TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS quotes_by_fingerprint ON quotes(fingerprint);
+    CREATE INDEX IF NOT EXISTS authors_by_name ON authors(name, quote_id);
+    CREATE INDEX IF NOT EXISTS authors_by_quote ON authors(quote_id);
+'''
+
+FTS_SCHEMA = '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS quotes_fts USING fts5(text, tokenize = 'unicode61 remove_diacritics 2');
+'''
+
+
+class SqliteQuoteStore:
+    """
+    A drop in replacement for the CSV backed QuoteStore that keeps the quotes database in SQLite. Every quote gets a
+    row in the quotes table, its quote/author pairs go in the pairs table, and every individual author it names goes
+    in an indexed authors table. The quote text is also kept in an FTS5 table so phrase searches can use the full
+    text index to find candidates instead of scoring every quote by someone.
+    """
+
+    def __init__(self, database_file: str, import_from: str = None) -> None:
+
+        self.database_file = Path(database_file)
+        self.version = 0  # Goes up on every add or delete, so anything derived from the quotes knows when it is stale
+        self.connection = sqlite3.connect(str(database_file))
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        self.connection.executescript(SCHEMA)
+
+        try:
+            self.connection.executescript(FTS_SCHEMA)
+            self.full_text = True
+        except sqlite3.OperationalError:  # SQLite was built without FTS5 so phrase searches score every candidate
+            self.full_text = False
+
+        # Checking for quotes rather than for the file means a first import that was interrupted, or that could not
+        # find the CSV, is tried again on the next start instead of leaving an empty database behind for good
+        if len(self) == 0 and import_from is not None and Path(import_from).exists():
+            self.import_csv(import_from)
+
+    def __len__(self) -> int:
+        return self.connection.execute('SELECT COUNT(*) FROM quotes').fetchone()[0]
+
+    authors_of = staticmethod(authors_of)
+
+    def _fetch(self, query: str, parameters: Iterable = ()) -> List[Quote]:
+        """Runs a query selecting (quote_id, quote, author) and groups the pairs back into quote tuples"""
+
+        quotes = list()
+
+        for _, pairs in groupby(self.connection.execute(query, tuple(parameters)), key=lambda pair: pair[0]):
+            quotes.append(tuple(string for _, quote, author in pairs for string in (quote, author)))
+
+        return quotes
+
+    def _insert(self, row: Quote) -> None:
+        """Inserts a quote and its pairs, authors and search text inside whatever transaction is currently open"""
+
+        quote_id = self.connection.execute('INSERT INTO quotes (fingerprint) VALUES (?)',
+                                           (fingerprint(row),)).lastrowid
+
+        self.connection.executemany('INSERT INTO pairs VALUES (?, ?, ?, ?)',
+                                    [(quote_id, i // 2, row[i], row[i + 1]) for i in range(0, len(row), 2)])
+        self.connection.executemany('INSERT INTO authors VALUES (?, ?)',
+                                    [(quote_id, name.casefold()) for name in set(authors_of(row))])
+
+        if self.full_text:
+            self.connection.execute('INSERT INTO quotes_fts (rowid, text) VALUES (?, ?)',
+                                    (quote_id, ' '.join(row[0::2])))
+
+    def rows(self) -> List[Quote]:
+        """Gets every quote currently in the database"""
+        return self._fetch('SELECT quote_id, quote, author FROM pairs ORDER BY quote_id, position')
+
+    def quotes_by(self, author: str) -> List[Quote]:
+        """
+        Gets every quote that names the given author in any of its author columns, or every quote in the database
+        if the author is 'random'
+
+        Parameters:
+            author - The name of the author to get the quotes for, case does not matter
+
+        Returns:
+            quotes - A list of tuples of all the quotes by this author
+        """
+
+        if author == 'random':
+            return self.rows()
+
+        return self._fetch('SELECT quote_id, quote, author FROM pairs WHERE quote_id IN '
+                           '(SELECT quote_id FROM authors WHERE name = ?) ORDER BY quote_id, position',
+                           (author.casefold(),))
+
+    def search(self, author: str, phrase: str, limit: int = 50) -> List[Quote]:
+        """
+        Gets the best full text matches for a phrase among an author's quotes, so only these candidates need to be
+        fuzzy scored. Falls back to all of the author's quotes if nothing shares a word with the phrase
+
+        Parameters:
+            author - The name of the author to search the quotes of, or 'random' to search every quote
+            phrase - The phrase we are trying to find the closest quote to
+            limit - The most candidates to return
+
+        Returns:
+            quotes - A list of tuples of the candidate quotes
+        """
+
+        words = re.findall(r'\w+', phrase)
+
+        if not self.full_text or not words:
+            return self.quotes_by(author)
+
+        match = ' OR '.join(f'"{word}"' for word in words)
+        author_filter = '' if author == 'random' else 'AND rowid IN (SELECT quote_id FROM authors WHERE name = ?)'
+        parameters = (match,) if author == 'random' else (match, author.casefold())
+
+        ranked = [quote_id for quote_id, in self.connection.execute(
+            f'SELECT rowid FROM quotes_fts WHERE quotes_fts MATCH ? {author_filter} ORDER BY rank LIMIT {int(limit)}',
+            parameters)]
+
+        if not ranked:
+            return self.quotes_by(author)
+
+        return self._fetch(f'SELECT quote_id, quote, author FROM pairs WHERE quote_id IN '
+                           f'({", ".join("?" * len(ranked))}) ORDER BY quote_id, position', ranked)
+
+    def closest_match(self, author: str, phrase: str) -> Optional[Quote]:
+        """
+        Gets the quote by an author that best matches a phrase, fuzzy scoring only the full text search candidates
+
+        Parameters:
+            author - The name of the author to search the quotes of, or 'random' to search every quote
+            phrase - The phrase we are trying to find the closest quote to
+
+        Returns:
+            quote - The closest quote, or None if the author has no quotes
+        """
+
+        candidates = self.search(author, phrase)
+        best = best_match(phrase, [quote_text(quote) for quote in candidates])
+
+        return None if best is None else candidates[best]
+
+    def contains(self, quote: Iterable[str]) -> bool:
+        """Checks if a quote with the exact same content, ignoring case and spacing, is already in the database"""
+        return self.connection.execute('SELECT 1 FROM quotes WHERE fingerprint = ? LIMIT 1',
+                                       (fingerprint(quote),)).fetchone() is not None
+
+    def get(self, key: str) -> Optional[Quote]:
+        """Gets the quote with the given fingerprint, or None if it is no longer in the database"""
+        quotes = self._fetch('SELECT quote_id, quote, author FROM pairs WHERE quote_id = '
+                             '(SELECT MIN(id) FROM quotes WHERE fingerprint = ?) ORDER BY position', (key,))
+        return quotes[0] if quotes else None
+
+    def add(self, quote: Iterable[str]) -> Quote:
+        """
+        Adds a new quote to the database in a single transaction, the authors are title cased to keep the database
+        homogeneous
+
+        Parameters:
+            quote - The quote/author pairs to add to the database
+
+        Returns:
+            row - The row exactly as it was written to the database
+        """
+
+        row = tuple(s.title() if i % 2 else s for i, s in enumerate(quote))
+
+        with self.connection:
+            self._insert(row)
+
+        self.version += 1
+        return row
+
+    def remove(self, partial_quote: Quote) -> List[Quote]:
+        """
+        Removes every quote that begins with the given quote/author pairs from the database in a single transaction,
+        compared without regard to case
+
+        Parameters:
+            partial_quote - The leading quote/author pairs of the quotes to remove
+
+        Returns:
+            removed - The rows that were removed, empty if no quote matched
+        """
+
+        if len(partial_quote) < 2:
+            return list()
+
+        names = split_authors(partial_quote[1])
+
+        if not names:
+            return list()
+
+        candidates = self.connection.execute('SELECT quote_id FROM authors WHERE name = ? ORDER BY quote_id',
+                                             (names[0].casefold(),)).fetchall()
+        removed = list()
+
+        with self.connection:
+            for quote_id, in candidates:
+
+                row = self._fetch('SELECT quote_id, quote, author FROM pairs WHERE quote_id = ? ORDER BY position',
+                                  (quote_id,))[0]
+
+                if all(string.lower() == partial.lower() for string, partial in zip(row, partial_quote)):
+                    self.connection.execute('DELETE FROM quotes WHERE id = ?', (quote_id,))
+                    if self.full_text:
+                        self.connection.execute('DELETE FROM quotes_fts WHERE rowid = ?', (quote_id,))
+                    removed.append(row)
+
+        self.version += len(removed)
+        return removed
+
+    @property
+    def needs_compaction(self) -> bool:
+        """SQLite reclaims deleted rows itself so there is never a journal for us to compact"""
+        return False
+
+    def compact(self) -> None:
+        """Nothing to do, deletes are already applied transactionally"""
+
+    def import_csv(self, csv_file: str) -> int:
+        """
+        Imports every quote from a quotes database CSV in one transaction, replaying its delete journal first so we
+        only import the live quotes. Quotes that are already in the database are skipped, so importing the same CSV
+        again, or one that overlaps with it, never duplicates anything
+
+        Parameters:
+            csv_file - The path to the quotes CSV to import
+
+        Returns:
+            count - The number of quotes that were imported
+        """
+
+        existing = {key for key, in self.connection.execute('SELECT fingerprint FROM quotes')}
+        rows = [row for row in QuoteStore(csv_file).rows() if fingerprint(row) not in existing]
+
+        with self.connection:
+            for row in rows:
+                self._insert(row)
+
+        self.version += len(rows)
+        return len(rows)
+
+    def export_csv(self, csv_file: str) -> int:
+        """
+        Exports every quote to a CSV in the same format the CSV backend uses, swapping the new file in atomically so
+        readers such as the backup script never see a half written file
+
+        Parameters:
+            csv_file - The path of the CSV to write
+
+        Returns:
+            count - The number of quotes that were exported
+        """
+
+        rows = self.rows()
+
+        with atomic_write(Path(csv_file)) as temp:
+            csv.writer(temp, quoting=csv.QUOTE_ALL).writerows(rows)
+
+        return len(rows)
+
+
+if __name__ == '__main__':
+
+    # Usage: python -m commands.sqlite_store import|export database.sqlite quotes.csv
+    if len(sys.argv) != 4 or sys.argv[1] not in ('import', 'export'):
+        print('Usage: python -m commands.sqlite_store import|export database.sqlite quotes.csv')
+        sys.exit(1)
+
+    STORE = SqliteQuoteStore(sys.argv[2])
+
+    if sys.argv[1] == 'import':
+        print(f'Imported {STORE.import_csv(sys.argv[3])} quotes into {sys.argv[2]}')
+    else:
+        print(f'Exported {STORE.export_csv(sys.argv[3])} quotes to {sys.argv[3]}')
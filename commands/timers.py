@@ -0,0 +1,118 @@
+import asyncio
+import heapq
+import itertools
+import json
+import time
+import traceback
+from pathlib import Path
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+from commands.persistence import save_json
+
+
+class TimerHeap:
+    """
+    A min-heap of timers that survives restarts of the bot. Every timer is a wall clock due time and a small JSON
+    payload, and a single background task sleeps until the earliest one is due instead of every command sleeping in
+    its own coroutine. All the timers that are due together are handed to the handler in one call, so it can act on
+    them as a batch. The heap is saved to a JSON file whenever it changes, and timers are only forgotten once their
+    handler has finished, so a crash part way through a batch runs it again on the next start. The handler returns
+    the payloads it failed on, or raises to fail the whole batch, and those timers go off again after a backoff that
+    doubles with every failed attempt, until they succeed or run out of retries.
+    """
+
+    def __init__(self, state_file: str, handler: Callable[[List[Any]], Awaitable[Optional[List[Any]]]],
+                 retry_delay: float = 30., max_retries: int = 8) -> None:
+
+        self.state_file = Path(state_file)
+        self.handler = handler
+        self.retry_delay = retry_delay
+        self.max_retries = max_retries
+        self._heap: List[Tuple[float, int, Any, int]] = list()  # Due time, order, payload and failed attempts so far
+        self._running: List[Tuple[float, int, Any, int]] = list()  # The batch being handled, saved until it is done
+        self._order = itertools.count()  # Breaks ties between timers due at the same time, so payloads are not compared
+        self._wakeup = None
+        self._task = None
+
+        if self.state_file.exists():
+            with open(self.state_file, 'r') as state:
+                self._heap = [(due, next(self._order), payload, failures)
+                              for due, payload, failures in json.load(state)]
+            heapq.heapify(self._heap)
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def schedule(self, delay: float, payload: Any) -> None:
+        """Adds a timer that goes off after the given number of seconds"""
+        self._push(delay, payload, 0)
+        self.save()
+
+    def _push(self, delay: float, payload: Any, failures: int) -> None:
+
+        heapq.heappush(self._heap, (time.time() + delay, next(self._order), payload, failures))
+
+        if self._wakeup is not None:
+            self._wakeup.set()  # The new timer might be due before the one the task is sleeping until
+
+    def cancel(self, matches: Callable[[Any], bool]) -> int:
+        """Removes every timer whose payload matches, returning how many there were"""
+
+        remaining = [timer for timer in self._heap if not matches(timer[2])]
+        cancelled = len(self._heap) - len(remaining)
+
+        if cancelled:
+            self._heap = remaining
+            heapq.heapify(self._heap)
+            self.save()
+
+        return cancelled
+
+    def start(self) -> None:
+        """Starts the background task that runs the timers, doing nothing if it is already running"""
+
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self) -> None:
+        """Sleeps until the earliest timer is due, hands every due timer to the handler, and repeats"""
+
+        while True:
+
+            self._wakeup.clear()
+            delay = self._heap[0][0] - time.time() if self._heap else None
+
+            if delay is None or 0 < delay:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            while self._heap and self._heap[0][0] <= time.time():
+                self._running.append(heapq.heappop(self._heap))
+
+            try:
+                failed = await self.handler([payload for _, _, payload, _ in self._running]) or list()
+            except Exception:
+                print('Timer handler failed:')
+                traceback.print_exc()
+                failed = [payload for _, _, payload, _ in self._running]
+
+            for _, _, payload, failures in self._running:
+                if payload not in failed:
+                    continue
+                if failures < self.max_retries:
+                    self._push(self.retry_delay * 2 ** failures, payload, failures + 1)
+                else:
+                    print(f'Giving up on timer {payload} after {failures + 1} attempts')
+
+            self._running.clear()
+            self.save()
+
+    def save(self) -> None:
+        """Atomically writes every pending timer to the state file"""
+
+        save_json(self.state_file,
+                  [(due, payload, failures) for due, _, payload, failures in self._running + sorted(self._heap)])
@@ -1,4 +1,6 @@
-import commands
-
 if __name__ == '__main__':
+
+    # Imported here so the chart worker processes, which run this file again when they start, never load the bot
+    import commands
+
     commands.start_bot()  # Application entry point
@@ -0,0 +1,72 @@
+import json
+
+from backup_scripts import backup_memes
+from backup_scripts.backup_memes import ROOT_FOLDER, LocalDriveClient
+
+
+class FlakyDrive(LocalDriveClient):
+    """A local drive whose uploads of some files fail a given number of times first, recording every upload"""
+
+    def __init__(self, root, failures):
+        super().__init__(root)
+        self.failures = dict(failures)
+        self.uploads = list()
+
+    def upload(self, path, title, parent_id, file_id=None):
+        self.uploads.append(title)
+        if self.failures.get(title):
+            self.failures[title] -= 1
+            raise OSError('Drive is having a bad day')
+        return super().upload(path, title, parent_id, file_id)
+
+
+def make_memes(memes):
+    for author, count in (('bob', 4), ('amy', 1)):
+        (memes / author).mkdir(parents=True)
+        for i in range(count):
+            (memes / author / f'{i}.png').write_bytes(f'{author} meme {i}'.encode())
+
+
+def test_backup_skips_adopts_and_retries(tmp_path, monkeypatch):
+
+    monkeypatch.setattr(backup_memes.time, 'sleep', lambda seconds: None)
+
+    memes, manifest = tmp_path / 'memes', tmp_path / 'manifest.json'
+    make_memes(memes)
+
+    # Amy's meme was backed up before there was a manifest, so it should be adopted rather than uploaded again
+    (tmp_path / 'drive' / ROOT_FOLDER / 'amy').mkdir(parents=True)
+    (tmp_path / 'drive' / ROOT_FOLDER / 'amy' / '0.png').write_bytes(b'amy meme 0')
+
+    drive = FlakyDrive(tmp_path / 'drive', {'2.png': 2})
+
+    assert backup_memes.backup_memes(drive, str(memes), manifest) == 4
+    assert sorted(drive.uploads) == ['0.png', '1.png', '2.png', '2.png', '2.png', '3.png']
+    assert (tmp_path / 'drive' / ROOT_FOLDER / 'bob' / '2.png').read_bytes() == b'bob meme 2'
+    assert json.loads(manifest.read_text())['files']['amy/0.png']['id'] == f'{ROOT_FOLDER}/amy/0.png'
+
+    # Nothing changed so nothing is uploaded, and only the changed meme is uploaded after an edit
+    drive.uploads.clear()
+    assert backup_memes.backup_memes(drive, str(memes), manifest) == 0
+    assert drive.uploads == list()
+
+    (memes / 'bob' / '1.png').write_bytes(b'edited')
+    assert backup_memes.backup_memes(drive, str(memes), manifest) == 1
+    assert drive.uploads == ['1.png']
+    assert (tmp_path / 'drive' / ROOT_FOLDER / 'bob' / '1.png').read_bytes() == b'edited'
+
+
+def test_a_failed_upload_is_tried_again_next_run(tmp_path, monkeypatch):
+
+    monkeypatch.setattr(backup_memes.time, 'sleep', lambda seconds: None)
+
+    memes, manifest = tmp_path / 'memes', tmp_path / 'manifest.json'
+    make_memes(memes)
+    drive = FlakyDrive(tmp_path / 'drive', {'3.png': backup_memes.UPLOAD_ATTEMPTS})
+
+    assert backup_memes.backup_memes(drive, str(memes), manifest) == 4
+    assert 'bob/3.png' not in json.loads(manifest.read_text())['files']
+
+    drive.uploads.clear()
+    assert backup_memes.backup_memes(drive, str(memes), manifest) == 1
+    assert drive.uploads == ['3.png']
@@ -0,0 +1,57 @@
+import random
+
+from backup_scripts.backup_quotes import LocalWorksheet, sync_quotes
+
+
+def random_row(rng: random.Random):
+    return [f'quote {rng.random():.6f}', rng.choice(('Bob', 'Mary', 'Bob & Mary'))] * rng.randint(1, 3)
+
+
+def sheet_rows(sheet_file):
+    """Reads back the sheet with the blank cells the sync pads narrower rows with trimmed off"""
+
+    rows = LocalWorksheet(sheet_file).rows
+
+    while any(row and not row[-1] for row in rows):
+        rows = [row[:-1] if row and not row[-1] else row for row in rows]
+
+    return rows
+
+
+def test_random_edits_keep_the_sheet_in_sync(tmp_path):
+
+    rng = random.Random(1)
+    sheet_file, snapshot = tmp_path / 'sheet.csv', tmp_path / 'snapshot.json'
+    sheet = LocalWorksheet(sheet_file)
+    cells = [random_row(rng) for _ in range(200)]
+
+    assert sync_quotes(sheet, cells, snapshot) == 1  # Without a snapshot every cell is written in one go
+
+    for _ in range(200):
+
+        cells = [list(row) for row in cells]
+
+        for _ in range(rng.randint(0, 6)):
+            edit = rng.random()
+            if edit < .3:
+                cells.append(random_row(rng))
+            elif edit < .5 and cells:
+                del cells[rng.randrange(len(cells))]
+            elif edit < .8 and cells:
+                cells[rng.randrange(len(cells))] = random_row(rng)
+            else:
+                cells.insert(rng.randrange(len(cells) + 1), random_row(rng))
+
+        sync_quotes(sheet, cells, snapshot)
+        assert sheet_rows(sheet_file) == cells
+
+
+def test_only_changes_are_sent(tmp_path):
+
+    rng = random.Random(2)
+    sheet, snapshot = LocalWorksheet(tmp_path / 'sheet.csv'), tmp_path / 'snapshot.json'
+    cells = [random_row(rng) for _ in range(50)]
+    sync_quotes(sheet, cells, snapshot)
+
+    assert sync_quotes(sheet, cells, snapshot) == 0
+    assert sync_quotes(sheet, cells + [random_row(rng)], snapshot) == 1
@@ -0,0 +1,97 @@
+import asyncio
+import io
+import random
+
+from PIL import Image, ImageDraw, ImageFilter
+
+from commands.meme_hashes import MemeHashes, digest
+
+WORDS = ('bruh', 'why', 'pickle', 'homework', 'never', 'again', 'tonight', 'exam')
+
+
+def png(image: Image.Image) -> bytes:
+    data = io.BytesIO()
+    image.save(data, 'PNG')
+    return data.getvalue()
+
+
+def text_meme(rng: random.Random) -> bytes:
+    """A screenshot of a few lines of black text on white, like a tweet"""
+
+    image = Image.new('RGB', (600, 300), 'white')
+    draw = ImageDraw.Draw(image)
+
+    for line in range(rng.randint(1, 5)):
+        draw.text((20, 20 + 40 * line), ' '.join(rng.choices(WORDS, k=rng.randint(2, 8))), fill='black')
+
+    return png(image)
+
+
+def photo(rng: random.Random) -> Image.Image:
+    """A picture with some big blurry blobs of colour in it, standing in for a photo"""
+
+    image = Image.new('RGB', (400, 300), 'gray')
+    draw = ImageDraw.Draw(image)
+
+    for _ in range(12):
+        x, y = rng.randrange(400), rng.randrange(300)
+        draw.ellipse((x - 60, y - 60, x + 60, y + 60), fill=tuple(rng.randrange(256) for _ in range(3)))
+
+    return image.filter(ImageFilter.GaussianBlur(8))
+
+
+def add(hashes: MemeHashes, key: str, data: bytes) -> None:
+    author, filename = key.split('/')
+    hashes.add(author, filename, (len(data), 0), digest(data))
+
+
+def test_distinct_text_memes_are_accepted(tmp_path):
+
+    hashes = MemeHashes(str(tmp_path / 'hashes.json'), str(tmp_path))
+    rng = random.Random(0)
+
+    for i in range(20):
+        meme = text_meme(rng)
+        assert hashes.duplicate_of(digest(meme)) is None
+        add(hashes, f'bob/tweet{i}.png', meme)
+
+
+def test_flat_images_are_not_lookalikes(tmp_path):
+
+    hashes = MemeHashes(str(tmp_path / 'hashes.json'), str(tmp_path))
+    add(hashes, 'bob/white.png', png(Image.new('RGB', (300, 300), 'white')))
+
+    assert hashes.lookalike_of(digest(png(Image.new('RGB', (200, 100), 'black')))) is None
+
+
+def test_only_exact_copies_are_duplicates(tmp_path):
+
+    hashes = MemeHashes(str(tmp_path / 'hashes.json'), str(tmp_path))
+    picture = photo(random.Random(0))
+    original = png(picture)
+    add(hashes, 'bob/photo.png', original)
+
+    recompressed = io.BytesIO()
+    picture.resize((200, 150)).save(recompressed, 'JPEG', quality=60)
+
+    assert hashes.duplicate_of(digest(original)) == 'bob/photo.png'
+    assert hashes.duplicate_of(digest(recompressed.getvalue())) is None
+    assert hashes.lookalike_of(digest(recompressed.getvalue())) == 'bob/photo.png'
+
+
+def test_added_hashes_are_saved_together_later(tmp_path):
+
+    state_file = tmp_path / 'hashes.json'
+    rng = random.Random(0)
+
+    async def add_batch():
+        hashes = MemeHashes(str(state_file), str(tmp_path), save_delay=.05)
+        for i in range(3):
+            add(hashes, f'bob/tweet{i}.png', text_meme(rng))
+        assert not state_file.exists()
+        await asyncio.sleep(.1)
+
+    asyncio.new_event_loop().run_until_complete(add_batch())
+
+    reloaded = MemeHashes(str(state_file), str(tmp_path))
+    assert reloaded.duplicate_of(digest(text_meme(random.Random(0)))) == 'bob/tweet0.png'
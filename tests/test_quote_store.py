@@ -0,0 +1,78 @@
+import csv
+import stat
+
+from commands.quote_store import QuoteStore
+
+
+def csv_rows(csv_file):
+    with open(csv_file, 'r') as file:
+        return [tuple(row) for row in csv.reader(file) if row]
+
+
+def test_deletes_are_replayed_on_load(tmp_path):
+
+    csv_file = tmp_path / 'quotes.csv'
+    store = QuoteStore(str(csv_file))
+    store.add(('hello', 'bob'))
+    store.add(('hi', 'mary', 'bye', 'bob & mary'))
+
+    assert store.remove(('hello', 'Bob')) == [('hello', 'Bob')]
+
+    # The database itself is untouched, the delete only lives in the journal
+    assert len(csv_rows(csv_file)) == 2
+    assert QuoteStore(str(csv_file)).rows() == [('hi', 'Mary', 'bye', 'Bob & Mary')]
+
+
+def test_a_deleted_quote_that_is_added_again_survives_a_reload(tmp_path):
+
+    csv_file = tmp_path / 'quotes.csv'
+    store = QuoteStore(str(csv_file))
+    store.add(('hello', 'bob'))
+    store.remove(('hello', 'bob'))
+    store.add(('hello', 'bob'))
+
+    reloaded = QuoteStore(str(csv_file))
+    assert reloaded.rows() == [('hello', 'Bob')]
+    assert reloaded.quotes_by('bob') == [('hello', 'Bob')]
+
+
+def test_compaction_rewrites_the_database_and_clears_the_journal(tmp_path):
+
+    csv_file = tmp_path / 'quotes.csv'
+    store = QuoteStore(str(csv_file), compaction_threshold=2)
+    for number in range(4):
+        store.add((f'quote {number}', 'bob'))
+    csv_file.chmod(0o640)
+
+    store.remove(('quote 0', 'bob'))
+    store.remove(('quote 2', 'bob'))
+    assert store.needs_compaction
+    store.compact()
+
+    assert not store.needs_compaction
+    assert not store.journal_file.exists()
+    assert stat.S_IMODE(csv_file.stat().st_mode) == 0o640
+    assert csv_rows(csv_file) == [('quote 1', 'Bob'), ('quote 3', 'Bob')]
+    assert QuoteStore(str(csv_file)).rows() == [('quote 1', 'Bob'), ('quote 3', 'Bob')]
+
+
+def test_a_journal_left_over_from_an_older_database_is_ignored(tmp_path):
+
+    csv_file = tmp_path / 'quotes.csv'
+    store = QuoteStore(str(csv_file))
+    store.add(('hello', 'bob'))
+    store.add(('hi', 'mary'))
+    store.remove(('hello', 'bob'))
+    journal = store.journal_file.read_text()
+
+    # A compaction that crashed after swapping in the new database but before clearing the journal
+    store.compact()
+    store.add(('hello', 'bob'))
+    store.journal_file.write_text(journal)
+
+    reloaded = QuoteStore(str(csv_file))
+    assert reloaded.rows() == [('hi', 'Mary'), ('hello', 'Bob')]
+
+    # The next delete starts a journal for the current database rather than adding to the stale one
+    reloaded.remove(('hi', 'mary'))
+    assert QuoteStore(str(csv_file)).rows() == [('hello', 'Bob')]
@@ -0,0 +1,25 @@
+import asyncio
+import json
+
+from commands.persistence import PENDING, flush_pending_saves
+from commands.rotation import ShuffleBag
+
+
+def test_draws_just_before_shutdown_are_saved(tmp_path):
+
+    state_file = tmp_path / 'rotation.json'
+
+    async def draw():
+        bag = ShuffleBag(str(state_file), save_delay=30.)
+        return bag.draw('random', lambda: ['a', 'b', 'c'], lambda key: True)
+
+    # The loop stops long before the debounced save is due, like it does when the bot is shut down
+    drawn = asyncio.new_event_loop().run_until_complete(draw())
+    assert not state_file.exists()
+
+    flush_pending_saves()
+
+    assert not PENDING
+    remaining = json.loads(state_file.read_text())['random']
+    assert sorted(remaining + [drawn]) == ['a', 'b', 'c']
+    assert ShuffleBag(str(state_file)).draw('random', lambda: [], lambda key: True) == remaining[0]
@@ -0,0 +1,30 @@
+from datetime import datetime
+
+import pytest
+
+from commands.scheduler import CronSchedule, parse_field
+
+
+def test_fields_parse_like_cron():
+    assert parse_field('*/15', 0, 59) == [0, 15, 30, 45]
+    assert parse_field('5/10', 0, 59) == [5, 15, 25, 35, 45, 55]
+    assert parse_field('1-5,0', 0, 7) == [0, 1, 2, 3, 4, 5]
+
+
+@pytest.mark.parametrize('expression', ['* * *', '60 * * * *', '*/0 * * * *', 'noon * * * *'])
+def test_bad_expressions_are_rejected(expression):
+    with pytest.raises(ValueError):
+        CronSchedule(expression)
+
+
+def test_day_of_month_or_day_of_week():
+    # The 13th, or any Friday, like cron does when both are restricted
+    schedule = CronSchedule('0 9 13 * 5')
+    assert schedule.next_after(datetime(2024, 9, 1)) == datetime(2024, 9, 6, 9)
+    assert schedule.next_after(datetime(2024, 9, 11, 12)) == datetime(2024, 9, 13, 9)
+
+
+def test_a_stepped_star_still_counts_as_unrestricted():
+    # Odd days that are also Mondays, since cron only ORs the two when neither starts with *
+    schedule = CronSchedule('0 9 */2 * 1')
+    assert schedule.next_after(datetime(2024, 9, 1)) == datetime(2024, 9, 9, 9)
@@ -0,0 +1,27 @@
+import csv
+
+from commands.sqlite_store import SqliteQuoteStore
+
+
+def write_quotes(csv_file, rows):
+    with open(csv_file, 'w', newline='') as file:
+        csv.writer(file, quoting=csv.QUOTE_ALL).writerows(rows)
+
+
+def test_first_import_is_retried_and_never_duplicates(tmp_path):
+
+    database, quotes = tmp_path / 'quotes.sqlite', tmp_path / 'quotes.csv'
+
+    # The CSV is not there on the first start, which must not stop it being imported on the next one
+    assert len(SqliteQuoteStore(str(database), import_from=str(quotes))) == 0
+
+    write_quotes(quotes, [('hello', 'Bob'), ('hi', 'Mary', 'bye', 'Bob')])
+    store = SqliteQuoteStore(str(database), import_from=str(quotes))
+    assert sorted(store.rows()) == [('hello', 'Bob'), ('hi', 'Mary', 'bye', 'Bob')]
+
+    # Importing by hand after the automatic import only adds the quotes that are new
+    write_quotes(quotes, [('hello', 'Bob'), ('hi', 'Mary', 'bye', 'Bob'), ('new', 'Amy')])
+    assert store.import_csv(str(quotes)) == 1
+    assert store.import_csv(str(quotes)) == 0
+    assert len(store) == 3
+    assert len(SqliteQuoteStore(str(database), import_from=str(quotes))) == 3
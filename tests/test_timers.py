@@ -0,0 +1,50 @@
+import asyncio
+import json
+
+from commands.timers import TimerHeap
+
+
+def test_failed_timers_are_retried_with_backoff(tmp_path):
+
+    calls = list()
+
+    async def handler(payloads):
+        calls.append(sorted(payloads))
+        return ['flaky'] if len(calls) < 3 else list()
+
+    async def run():
+        timers = TimerHeap(str(tmp_path / 'timers.json'), handler, retry_delay=.01)
+        timers.start()
+        timers.schedule(0, 'steady')
+        timers.schedule(0, 'flaky')
+        await asyncio.sleep(.3)
+        timers._task.cancel()
+        return timers
+
+    timers = asyncio.new_event_loop().run_until_complete(run())
+
+    assert calls == [['flaky', 'steady'], ['flaky'], ['flaky']]
+    assert len(timers) == 0
+    assert json.loads((tmp_path / 'timers.json').read_text()) == list()
+
+
+def test_a_raising_handler_retries_the_batch_until_it_gives_up(tmp_path):
+
+    calls = list()
+
+    async def handler(payloads):
+        calls.append(payloads)
+        raise RuntimeError('discord is down')
+
+    async def run():
+        timers = TimerHeap(str(tmp_path / 'timers.json'), handler, retry_delay=.001, max_retries=2)
+        timers.start()
+        timers.schedule(0, [1, 2])
+        await asyncio.sleep(.2)
+        timers._task.cancel()
+        return timers
+
+    timers = asyncio.new_event_loop().run_until_complete(run())
+
+    assert calls == [[[1, 2]]] * 3
+    assert len(timers) == 0